@@ -0,0 +1,58 @@
+import os
+import re
+import time
+import streamlit as st
+from perf_metrics import get_metrics
+
+# Shared Streamlit plumbing for ocr1.py and pdf.py: work that used to be
+# repeated on every rerun is done once per process or once per session here.
+
+STYLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "styles")
+
+# st.fragment (Streamlit >= 1.37) reruns only the decorated function when a
+# widget inside it changes; on older versions it falls back to a plain call.
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+
+def polling_fragment(seconds):
+    """Like `fragment`, but the function also reruns on its own every `seconds`"""
+    if not (hasattr(st, "fragment") or hasattr(st, "experimental_fragment")):
+        return fragment
+    return fragment(run_every=seconds)
+
+
+@st.cache_resource(show_spinner=False)
+def _load_css(name):
+    """Read and minify a stylesheet once per process"""
+    with open(os.path.join(STYLES_DIR, name), encoding="utf-8") as f:
+        css = f.read()
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css).strip()
+    return f"<style>{css}</style>"
+
+
+def inject_css(name):
+    """Add a stylesheet from styles/ to the page"""
+    # Streamlit drops any element a rerun doesn't emit, so the tag is sent every
+    # run; only the file read and minification are cached.
+    st.markdown(_load_css(name), unsafe_allow_html=True)
+
+
+def init_session_state(defaults):
+    """Fill in missing session-state keys (callables are called for fresh values)"""
+    if st.session_state.get("_state_initialized"):
+        return
+    for key, value in defaults.items():
+        if key not in st.session_state:
+            st.session_state[key] = value() if callable(value) else value
+    st.session_state["_state_initialized"] = True
+
+
+def start_run_timer():
+    """Mark the start of a script run for interaction-latency measurement"""
+    return time.perf_counter()
+
+
+def finish_run_timer(started, app):
+    """Record how long this rerun took from the top of the script to the bottom"""
+    get_metrics().observe("script_run", time.perf_counter() - started, app=app)
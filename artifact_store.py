@@ -0,0 +1,244 @@
+import gzip
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from perf_metrics import get_metrics
+
+# Content-addressed, compressed blob store for extracted text, code and upload images.
+#
+# Each blob is stored once under the SHA-256 of its content, so the same text
+# extracted twice (or referenced from several places) costs one file. Sessions
+# keep only the hex reference and load content when it is shown; recently read
+# blobs are kept decoded in a small process-wide cache.
+#
+# zstd is used when the `zstandard` package is installed, gzip otherwise.
+# Reads handle both, so a store written with either can be read by the other.
+#
+# The store is a cache, not an archive: blobs unused for ARTIFACT_MAX_AGE_DAYS
+# are deleted, and so are the least recently used ones once the store grows
+# past ARTIFACT_MAX_BYTES.
+
+# ------------------ Config ------------------
+ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR", os.path.join(tempfile.gettempdir(), "code-genei-artifacts"))
+# Decoded blobs kept in memory across reruns and sessions
+READ_CACHE_BYTES = 32 * 1024 * 1024
+# Retention limits, checked at most every PRUNE_INTERVAL seconds after a write
+MAX_BYTES = int(os.environ.get("ARTIFACT_MAX_BYTES", str(512 * 1024 * 1024)))
+MAX_AGE_SECONDS = float(os.environ.get("ARTIFACT_MAX_AGE_DAYS", "7")) * 86400
+PRUNE_INTERVAL = 60
+# A blob in use has its mtime refreshed at most this often (reruns read the same blobs constantly)
+TOUCH_INTERVAL = 3600
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+metrics = get_metrics()
+
+
+def _compress(data):
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data), ".zst"
+    return gzip.compress(data, compresslevel=6), ".gz"
+
+
+def _decompress(data, ext):
+    if ext == ".zst":
+        if zstandard is None:
+            raise RuntimeError("Artifact is zstd-compressed; install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if ext == ".gz":
+        return gzip.decompress(data)
+    return data
+
+
+class ArtifactStore:
+    """Blobs on disk under <root>/<ref[:2]>/<ref><ext>, addressed by SHA-256"""
+
+    EXTENSIONS = (".zst", ".gz", ".bin")
+
+    def __init__(self, root=ARTIFACT_DIR, cache_bytes=READ_CACHE_BYTES, max_bytes=MAX_BYTES,
+                 max_age=MAX_AGE_SECONDS):
+        self.root = root
+        self.cache_bytes = cache_bytes
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cached_size = 0
+        self._prune_lock = threading.Lock()
+        self._last_prune = float("-inf")
+        self._touched = {}  # ref -> monotonic time its mtime was last refreshed
+
+    def _path(self, ref, ext):
+        return os.path.join(self.root, ref[:2], ref + ext)
+
+    def _find(self, ref):
+        for ext in self.EXTENSIONS:
+            path = self._path(ref, ext)
+            if os.path.exists(path):
+                return path, ext
+        raise KeyError(f"Unknown artifact {ref}")
+
+    def put(self, data, compress=True):
+        """Store bytes (or str as UTF-8) and return the reference; storing the same content again is free.
+
+        Pass compress=False for data that is already compressed, such as PNG or JPEG uploads.
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        ref = hashlib.sha256(data).hexdigest()
+        if self.exists(ref):
+            self._touch(ref)
+            metrics.incr("artifact_dedup")
+            return ref
+        with metrics.timer("artifact_put"):
+            stored, ext = _compress(data) if compress else (data, ".bin")
+            path = self._path(ref, ext)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so readers never see a half-written blob
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(stored)
+            os.replace(tmp, path)
+        metrics.incr("artifact_bytes_raw", len(data))
+        metrics.incr("artifact_bytes_stored", len(stored))
+        self._remember(ref, data)
+        self._maybe_prune()
+        return ref
+
+    def exists(self, ref):
+        return any(os.path.exists(self._path(ref, ext)) for ext in self.EXTENSIONS)
+
+    def get(self, ref):
+        """Return the bytes for a reference"""
+        with self._lock:
+            data = self._cache.get(ref)
+            if data is not None:
+                self._cache.move_to_end(ref)
+        if data is not None:
+            if not self._touch(ref):
+                self.put(data)  # pruned while still in use: write it back
+            return data
+        with metrics.timer("artifact_get"):
+            path, ext = self._find(ref)
+            with open(path, "rb") as f:
+                data = _decompress(f.read(), ext)
+        self._touch(ref)
+        self._remember(ref, data)
+        return data
+
+    def _touch(self, ref):
+        """Mark a blob as recently used, so retention deletes it last; False if it isn't on disk"""
+        now = time.monotonic()
+        if now - self._touched.get(ref, float("-inf")) < TOUCH_INTERVAL:
+            return True
+        try:
+            path, _ = self._find(ref)
+            os.utime(path)
+        except (KeyError, OSError):
+            self._touched.pop(ref, None)
+            return False
+        self._touched[ref] = now
+        return True
+
+    def get_text(self, ref):
+        return self.get(ref).decode("utf-8")
+
+    def _remember(self, ref, data):
+        if len(data) > self.cache_bytes // 4:
+            return
+        with self._lock:
+            if ref in self._cache:
+                return
+            self._cache[ref] = data
+            self._cached_size += len(data)
+            while self._cached_size > self.cache_bytes:
+                _, old = self._cache.popitem(last=False)
+                self._cached_size -= len(old)
+
+    def export_zip(self, entries):
+        """Zip (filename, ref) pairs into an archive and return its bytes; expired blobs are left out"""
+        buffer = io.BytesIO()
+        written = {}
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for filename, ref in entries:
+                if written.get(filename) == ref:
+                    continue
+                try:
+                    data = self.get(ref)
+                except KeyError:
+                    continue
+                if filename in written:
+                    filename = f"{ref[:8]}_{filename}"  # same name, different content
+                written[filename] = ref
+                archive.writestr(filename, data)
+        return buffer.getvalue()
+
+    # ---- retention ----
+    def _maybe_prune(self):
+        if time.monotonic() - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = time.monotonic()
+        threading.Thread(target=self.prune, daemon=True).start()
+
+    def prune(self):
+        """Delete blobs past max_age, then the least recently used until the store fits max_bytes.
+
+        Returns the number of bytes freed.
+        """
+        if not self._prune_lock.acquire(blocking=False):
+            return 0  # another thread is already pruning
+        try:
+            with metrics.timer("artifact_prune"):
+                entries = []
+                for dirpath, _, filenames in os.walk(self.root):
+                    for name in filenames:
+                        if name.endswith(".tmp"):
+                            continue  # being written right now
+                        path = os.path.join(dirpath, name)
+                        try:
+                            info = os.stat(path)
+                        except OSError:
+                            continue
+                        entries.append((info.st_mtime, info.st_size, path))
+                entries.sort()  # least recently written or read first
+                total = sum(size for _, size, _ in entries)
+                now = time.time()
+                freed = 0
+                for mtime, size, path in entries:
+                    if now - mtime <= self.max_age and total <= self.max_bytes:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    self._touched.pop(os.path.basename(path).split(".")[0], None)
+                    total -= size
+                    freed += size
+                    metrics.incr("artifact_pruned")
+            if freed:
+                metrics.incr("artifact_pruned_bytes", freed)
+            return freed
+        finally:
+            self._prune_lock.release()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the shared artifact store for this process"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ArtifactStore()
+            _store._maybe_prune()  # clear out what earlier runs left behind
+        return _store
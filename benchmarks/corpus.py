@@ -0,0 +1,206 @@
+import io
+import random
+import textwrap
+
+from PIL import Image, ImageDraw, ImageFont
+import fitz  # PyMuPDF
+
+# Deterministic benchmark corpus: the same seed always yields byte-identical
+# inputs, so timings from different runs (and machines) are comparable.
+
+CODE_SNIPPETS = {
+    "python": """
+        import numpy as np
+        from sklearn.linear_model import LinearRegression
+
+        def train(features, labels):
+            model = LinearRegression()
+            model.fit(features, labels)
+            return model
+
+        class Predictor:
+            def __init__(self, model):
+                self.model = model
+
+            def predict(self, rows):
+                return self.model.predict(np.asarray(rows))
+
+        if __name__ == "__main__":
+            print(train([[1], [2]], [2, 4]).coef_)
+    """,
+    "javascript": """
+        import { readFile } from 'fs/promises';
+
+        const parse = (text) => text.split('\\n').map((line) => line.trim());
+
+        function countWords(lines) {
+            let total = 0;
+            for (const line of lines) {
+                total += line.split(' ').length;
+            }
+            return total;
+        }
+
+        export async function main(path) {
+            const text = await readFile(path, 'utf8');
+            console.log(countWords(parse(text)));
+        }
+    """,
+    "java": """
+        import java.util.ArrayList;
+        import java.util.List;
+
+        public class Inventory {
+            private final List<String> items = new ArrayList<>();
+
+            public void add(String item) {
+                items.add(item);
+            }
+
+            public static void main(String[] args) {
+                Inventory inv = new Inventory();
+                inv.add("widget");
+                System.out.println(inv.items.size());
+            }
+        }
+    """,
+    "cpp": """
+        #include <iostream>
+        #include <vector>
+        using namespace std;
+
+        int sum(const vector<int>& values) {
+            int total = 0;
+            for (int v : values) total += v;
+            return total;
+        }
+
+        int main() {
+            vector<int> values = {1, 2, 3, 4};
+            std::cout << sum(values) << endl;
+            return 0;
+        }
+    """,
+}
+
+PROSE_WORDS = (
+    "the report describes quarterly results for the regional offices and lists "
+    "revenue costs staffing changes and open risks together with the actions "
+    "agreed by the committee during the review meeting held last month"
+).split()
+
+# name -> (font size in px, number of pages for PDF cases)
+SIZES = {
+    "small": (14, 1),
+    "medium": (20, 4),
+    "large": (28, 12),
+}
+# Font size of the high-resolution "scan" image per size, like a page photographed by a phone
+SCAN_FONT_SIZES = {
+    "small": 32,
+    "medium": 48,
+    "large": 72,
+}
+
+
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has a single fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def code_text(language, repeat=1):
+    """Return the reference snippet for a language, repeated `repeat` times"""
+    snippet = textwrap.dedent(CODE_SNIPPETS[language]).strip()
+    return "\n\n".join([snippet] * repeat)
+
+
+def prose_text(rng, lines=30, words_per_line=12):
+    """Deterministic pseudo-prose for text-layer pages"""
+    return "\n".join(" ".join(rng.choice(PROSE_WORDS) for _ in range(words_per_line)) for _ in range(lines))
+
+
+def render_text_image(text, font_size, padding=24):
+    """Render text as a black-on-white 'screenshot'"""
+    font = _font(font_size)
+    line_height = int(font_size * 1.4)
+    lines = text.splitlines() or [""]
+    probe = ImageDraw.Draw(Image.new("L", (1, 1)))
+    width = max(int(probe.textlength(line, font=font)) for line in lines) + 2 * padding
+    height = line_height * len(lines) + 2 * padding
+    image = Image.new("RGB", (max(width, 64), height), "white")
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((padding, padding + i * line_height), line, fill="black", font=font)
+    return image
+
+
+def _png_bytes(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def text_layer_pdf(rng, pages):
+    """PDF whose pages carry a real text layer (no OCR needed)"""
+    document = fitz.open()
+    for _ in range(pages):
+        page = document.new_page()
+        page.insert_text((72, 72), prose_text(rng), fontsize=10)
+    data = document.tobytes(no_new_id=True)  # no random /ID, so reruns give the same bytes
+    document.close()
+    return data
+
+
+def scanned_pdf(rng, pages, font_size):
+    """PDF whose pages are images only, like a scanner produces"""
+    document = fitz.open()
+    languages = sorted(CODE_SNIPPETS)
+    for _ in range(pages):
+        page = document.new_page()
+        image = render_text_image(code_text(rng.choice(languages)), font_size)
+        page.insert_image(page.rect, stream=_png_bytes(image), keep_proportion=True)
+    data = document.tobytes(no_new_id=True)  # no random /ID, so reruns give the same bytes
+    document.close()
+    return data
+
+
+def mixed_pdf(rng, pages, font_size):
+    """Alternating text-layer pages and pages with an embedded code screenshot"""
+    document = fitz.open()
+    languages = sorted(CODE_SNIPPETS)
+    for index in range(pages):
+        page = document.new_page()
+        if index % 2 == 0:
+            page.insert_text((72, 72), prose_text(rng, lines=20), fontsize=10)
+        else:
+            page.insert_text((72, 72), "Figure: code listing", fontsize=10)
+            image = render_text_image(code_text(rng.choice(languages)), font_size)
+            page.insert_image(fitz.Rect(72, 100, page.rect.width - 72, page.rect.height - 72),
+                              stream=_png_bytes(image), keep_proportion=True)
+    data = document.tobytes(no_new_id=True)  # no random /ID, so reruns give the same bytes
+    document.close()
+    return data
+
+
+def build_corpus(seed=1234, sizes=tuple(SIZES)):
+    """Generate every benchmark case; returns a list of dicts with name/kind/pages/data"""
+    cases = []
+    for size in sizes:
+        font_size, pages = SIZES[size]
+        for language in sorted(CODE_SNIPPETS):
+            image = render_text_image(code_text(language), font_size)
+            cases.append({"name": f"image_{language}_{size}", "kind": "image", "pages": 1,
+                          "language": language, "data": _png_bytes(image)})
+        # Fresh RNG per case so adding a case never changes the others
+        scan = render_text_image(prose_text(random.Random(f"{seed}-scan-image-{size}"), lines=40),
+                                 SCAN_FONT_SIZES[size], padding=SCAN_FONT_SIZES[size] * 2)
+        cases.append({"name": f"image_scan_{size}", "kind": "image", "pages": 1, "data": _png_bytes(scan)})
+        cases.append({"name": f"pdf_text_{size}", "kind": "pdf", "pages": pages,
+                      "data": text_layer_pdf(random.Random(f"{seed}-text-{size}"), pages)})
+        cases.append({"name": f"pdf_scanned_{size}", "kind": "pdf", "pages": pages,
+                      "data": scanned_pdf(random.Random(f"{seed}-scan-{size}"), pages, font_size)})
+        cases.append({"name": f"pdf_mixed_{size}", "kind": "pdf", "pages": pages,
+                      "data": mixed_pdf(random.Random(f"{seed}-mixed-{size}"), pages, font_size)})
+    return cases
@@ -0,0 +1,264 @@
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+# Benchmarks must not append to the app's metrics trace
+os.environ.setdefault("METRICS_TRACE_PATH", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+import pytesseract
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+import ocr_utils
+from corpus import SIZES, build_corpus, code_text, CODE_SNIPPETS
+from ocr_utils import (detect_code_language, extract_text_from_image, extract_text_from_pdf, prepare_ocr_image,
+                       AUTO_LANG)
+
+# Usage:
+#   python benchmarks/run_benchmarks.py --output benchmarks/baseline.json   # record your own baseline first
+#   python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json
+# No baseline is shipped: timings depend on the CPU and the Tesseract version, so
+# record one on the machine that runs the comparison (its "meta" says where it came from).
+# Exits with status 1 if any case is slower than the baseline by more than --tolerance.
+
+# Baseline "meta" fields that must match for timings to be comparable
+COMPARABLE_META = ("platform", "python", "tesseract")
+
+
+def measure(func, repeat):
+    """Time `repeat` untraced runs, then measure memory on one more; returns (median seconds, memory, last result)"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    # Tracing slows pure-Python code down a lot, so it never overlaps a timed run
+    return statistics.median(timings), measure_memory(func), result
+
+
+def measure_memory(func):
+    """Peak Python heap (tracemalloc) and, if psutil is installed, peak RSS growth of this process, in KB.
+
+    Only RSS sees native buffers such as decoded PIL images. Tesseract runs as a
+    separate process and shows up in neither.
+    """
+    peak_rss = [0]
+    done = threading.Event()
+    sampler = None
+    if psutil is not None:
+        process = psutil.Process()
+        baseline = process.memory_info().rss
+
+        def sample():
+            while not done.wait(0.002):
+                peak_rss[0] = max(peak_rss[0], process.memory_info().rss - baseline)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+    tracemalloc.start()
+    try:
+        func()
+        peak_python = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        done.set()
+    if sampler is not None:
+        sampler.join()
+    return {
+        "peak_python_mem_kb": round(peak_python / 1024, 1),
+        "peak_rss_kb": round(peak_rss[0] / 1024, 1) if sampler is not None else None,
+    }
+
+
+def clear_language_cache():
+    """Every timed "auto" run detects the language again instead of reusing the first run's result"""
+    ocr_utils._lang_cache.clear()
+
+
+def case_variants(case):
+    """(name, function, run) for each way a case is processed.
+
+    The plain variants match the first baseline. The `_auto` ones follow the
+    apps: the upload is decoded with prepare_ocr_image and the OCR language is
+    detected. `prepare_*` times the decode alone and needs no Tesseract.
+    """
+    data = case["data"]
+    if case["kind"] == "image":
+        def plain():
+            return extract_text_from_image(Image.open(io.BytesIO(data)))
+
+        def auto():
+            clear_language_cache()
+            return extract_text_from_image(prepare_ocr_image(data), lang=AUTO_LANG)
+
+        def prepare():
+            image = prepare_ocr_image(data)
+            return f"{image.size[0]}x{image.size[1]}"
+
+        return [
+            (case["name"], "extract_text_from_image", plain),
+            (f"{case['name']}_auto", "prepare_ocr_image+extract_text_from_image", auto),
+            (case["name"].replace("image_", "prepare_", 1), "prepare_ocr_image", prepare),
+        ]
+
+    def plain_pdf():
+        return extract_text_from_pdf(io.BytesIO(data))
+
+    def auto_pdf():
+        clear_language_cache()
+        return extract_text_from_pdf(io.BytesIO(data), lang=AUTO_LANG)
+
+    return [
+        (case["name"], "extract_text_from_pdf", plain_pdf),
+        (f"{case['name']}_auto", "extract_text_from_pdf", auto_pdf),
+    ]
+
+
+def bench_case(case, function, run, repeat):
+    seconds, memory, result = measure(run, repeat)
+    row = {
+        "function": function,
+        "pages": case["pages"],
+        "input_bytes": len(case["data"]),
+        "seconds": round(seconds, 6),
+        "per_page_ms": round(seconds * 1000 / case["pages"], 3),
+        "pages_per_sec": round(case["pages"] / seconds, 3) if seconds else None,
+        **memory,
+    }
+    if function == "prepare_ocr_image":
+        row["input_size"] = "{}x{}".format(*Image.open(io.BytesIO(case["data"])).size)
+        row["ocr_size"] = result
+        return row
+    row["output_chars"] = len(result)
+    if case.get("language"):
+        row["expected_language"] = case["language"]
+        row["detected_language"] = detect_code_language(result)
+    return row
+
+
+def bench_detect_code_language(repeat, iterations=2000):
+    """detect_code_language is pure Python, so time many calls per sample"""
+    rows = {}
+    for language in sorted(CODE_SNIPPETS):
+        text = code_text(language, repeat=4)
+
+        def run():
+            for _ in range(iterations):
+                detect_code_language(text)
+
+        seconds, memory, _ = measure(run, repeat)
+        rows[f"detect_{language}"] = {
+            "function": "detect_code_language",
+            "input_chars": len(text),
+            "seconds": round(seconds, 6),
+            "calls_per_sec": round(iterations / seconds, 1) if seconds else None,
+            "peak_python_mem_kb": memory["peak_python_mem_kb"],
+            "detected_language": detect_code_language(text),
+            "expected_language": language,
+        }
+    return rows
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of (case, baseline_s, current_s, ratio) that regressed beyond tolerance"""
+    regressions = []
+    for name, row in results["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if not old or not old.get("seconds"):
+            continue
+        ratio = row["seconds"] / old["seconds"]
+        row["baseline_seconds"] = old["seconds"]
+        row["vs_baseline"] = round(ratio, 3)
+        if ratio > 1 + tolerance:
+            regressions.append((name, old["seconds"], row["seconds"], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR / PDF extraction benchmarks")
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), choices=list(SIZES))
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--repeat", type=int, default=3, help="samples per case (median is reported)")
+    parser.add_argument("--only", default="", help="substring filter on case names")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="previous results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown vs baseline (0.10 = 10%%)")
+    args = parser.parse_args()
+    baseline = None
+    if args.baseline:
+        if not os.path.exists(args.baseline):
+            parser.error(f"no baseline at {args.baseline}; record one first with --output {args.baseline}")
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    try:
+        tesseract_version = str(pytesseract.get_tesseract_version())
+    except Exception:
+        tesseract_version = "unavailable"
+
+    results = {
+        "meta": {
+            "seed": args.seed,
+            "sizes": args.sizes,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "tesseract": tesseract_version,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": {},
+    }
+
+    for case in build_corpus(args.seed, args.sizes):
+        for name, function, run in case_variants(case):
+            if args.only and args.only not in name:
+                continue
+            try:
+                row = bench_case(case, function, run, args.repeat)
+            except pytesseract.TesseractNotFoundError:
+                print(f"{name:<28} skipped: Tesseract is not installed")
+                continue
+            results["results"][name] = row
+            rss = f"{row['peak_rss_kb']:>9.0f} KB rss" if row["peak_rss_kb"] is not None else ""
+            print(f"{name:<28} {row['seconds'] * 1000:>10.1f} ms  {row['per_page_ms']:>9.1f} ms/page  "
+                  f"{row['peak_python_mem_kb']:>9.0f} KB py {rss}")
+
+    for name, row in bench_detect_code_language(args.repeat).items():
+        if args.only and args.only not in name:
+            continue
+        results["results"][name] = row
+        print(f"{name:<28} {row['calls_per_sec']:>10.0f} calls/s")
+
+    regressions = []
+    if baseline is not None:
+        for key in COMPARABLE_META:
+            old = baseline.get("meta", {}).get(key)
+            if old != results["meta"][key]:
+                print(f"WARNING baseline {key} is {old!r}, this run is {results['meta'][key]!r}; "
+                      f"timings may not be comparable")
+        regressions = compare(results, baseline, args.tolerance)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    for name, old, new, ratio in regressions:
+        print(f"REGRESSION {name}: {old * 1000:.1f} ms -> {new * 1000:.1f} ms ({ratio:.2f}x)")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
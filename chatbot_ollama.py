@@ -1,21 +1,40 @@
 import streamlit as st
-import requests
+import time
+import uuid
+from ollama_client import (chat_request, stream_with_heartbeat, GENERATIONS, GENERATION_TIMEOUT,
+                           GenerationCancelled, OllamaHTTPError)
+from perf_metrics import get_metrics, render_metrics_panel
+from ollama_scheduler import get_scheduler, acquire_with_status, QueueFullError
+from model_router import get_router, AUTO_MODEL
+from prompts import chat_messages
 
 #  Page setup
 st.set_page_config(page_title="Ollama Chatbot", page_icon="🤖")
 st.title("Chatbot with Ollama")
 st.write("Choose a model and start chatting!")
 
+metrics = get_metrics()
+render_metrics_panel(metrics, st.sidebar)
+
 #  List of your installed models
 models = ["deepseek-r1:1.5b", "llama3.2:1b", "mario:latest", "llama3.1:8b"]
 
-#  Dropdown for model selection
-selected_model = st.selectbox("Select a model:", models)
+#  Dropdown for model selection ("auto" lets model_router pick per message)
+selected_model = st.selectbox("Select a model:", [AUTO_MODEL] + models)
 
 #  Store chat history
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+#  Identifies this browser session to the shared request scheduler
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+#  Stop button: clicking interrupts the running script; cancelling closes the stream so Ollama stops decoding
+if st.sidebar.button("⏹ Stop generating"):
+    if GENERATIONS.cancel_session(st.session_state.session_id):
+        st.toast("Generation stopped")
+
 #  Display past messages
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
@@ -27,20 +46,70 @@ if prompt := st.chat_input("Type your message here..."):
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    #  Send to Ollama API with selected model
-    response = requests.post(
-        "http://localhost:11434/api/chat",
-        json={
-            "model": selected_model,  # 👈 dynamic model choice
-            "messages": [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages],
-            "stream": False
-        }
-    )
-
-    if response.status_code == 200:
-        bot_reply = response.json()["message"]["content"]
-    else:
-        bot_reply = "Error: " + response.text
+    #  Send to Ollama API with selected model, once the scheduler gives us a slot
+    router = get_router()
+    decision = None
+    streamed = {"text": ""}
+    bot_reply = None
+    try:
+        try:
+            with metrics.timer("queue_wait"):
+                ticket = acquire_with_status(get_scheduler().submit(st.session_state.session_id), st.empty())
+        except QueueFullError as e:
+            bot_reply = "Error: " + str(e)
+        else:
+            messages = chat_messages(st.session_state.messages)
+            earlier = "\n".join(m["content"] for m in st.session_state.messages[:-1])
+            decision = router.route(prompt, earlier, app="chatbot_ollama", model=selected_model)
+
+            placeholder = None
+
+            def render(text):
+                streamed["text"] = text
+                placeholder.markdown(text + "▌")
+
+            try:
+                with ticket, metrics.timer("llm_request", source="chatbot_ollama"):
+                    #  Drawn inside the ticket, so an interruption here still releases the slot
+                    with st.chat_message("assistant"):
+                        placeholder = st.empty()
+                    #  Streamed so Stop, a newer message or the deadline can stop it and free the model
+                    start = time.perf_counter()
+                    cancel = GENERATIONS.begin(st.session_state.session_id, timeout=GENERATION_TIMEOUT)
+                    try:
+                        result = stream_with_heartbeat(
+                            lambda: chat_request(decision.model, messages, stream=True),  # 👈 dynamic model choice
+                            cancel,
+                            render
+                        )
+                    finally:
+                        GENERATIONS.finish(st.session_state.session_id, cancel)
+                metrics.record_ollama(result["final"], source="chatbot_ollama")
+                metrics.record_stream(result, start, source="chatbot_ollama")
+                router.record(decision, result=result)
+                bot_reply = result["text"]
+            except OllamaHTTPError as e:
+                router.record(decision, outcome="http_error")
+                bot_reply = "Error: " + e.text
+            except GenerationCancelled as e:
+                router.record(decision, outcome="cancelled")
+                metrics.incr("generations_cancelled", reason=e.reason)
+                bot_reply = f"{e.partial_text}\n\n⏹ Generation {e.reason}.".strip()
+            except Exception as e:
+                #  e.g. Ollama unreachable; only Streamlit's own interruption counts as stopped
+                router.record(decision, outcome="error")
+                bot_reply = f"Error: {e}"
+            if placeholder is not None:
+                placeholder.empty()
+    finally:
+        if bot_reply is None:
+            #  Stop or a newer message ended this run mid-answer (Streamlit's rerun/stop
+            #  exceptions are BaseExceptions, so nothing above caught them): keep what had streamed so far
+            metrics.incr("generations_cancelled", reason="stopped")
+            if decision:
+                router.record(decision, outcome="cancelled")
+            st.session_state.messages.append(
+                {"role": "assistant", "content": f"{streamed['text']}\n\n⏹ Generation stopped.".strip()})
 
     st.session_state.messages.append({"role": "assistant", "content": bot_reply})
     with st.chat_message("assistant"):
@@ -1,22 +1,46 @@
 import streamlit as st
-import requests
+import queue
+import threading
+import time
+import uuid
 from datetime import datetime
+from perf_metrics import get_metrics, render_metrics_panel
+from ollama_client import (chat_request, consume_stream, stream_with_heartbeat, GENERATIONS,
+                           GENERATION_TIMEOUT, GenerationCancelled, OllamaHTTPError)
+from ollama_scheduler import get_scheduler, acquire_with_status, QueueFullError
+from model_router import get_router, AUTO_MODEL
+from prompts import chat_messages
 
 # ---------------- Page Config ----------------
 st.set_page_config(page_title="Chatbot with Ollama", layout="wide")
 
+metrics = get_metrics()
+
 # ---------------- Sidebar ----------------
 # ---------------- Sidebar ----------------
 st.sidebar.title("⚙️ Settings")
 
 # Installed models on your system
 model_options = ["deepseek-r1:1.5b", "llama3.2:1b", "mario:latest", "llama3.1:8b"]
-MODEL_NAME = st.sidebar.selectbox("Choose a model", model_options, index=0)
+# "auto" lets model_router pick the cheapest model that suits each message
+MODEL_NAME = st.sidebar.selectbox("Choose a model", [AUTO_MODEL] + model_options, index=0)
+
+# Comparison mode: same conversation sent to several models in parallel
+compare_mode = st.sidebar.checkbox("🔀 Compare models", value=False,
+                                   help="Send each message to several models at once and compare answers side by side")
+compare_models = []
+if compare_mode:
+    compare_models = st.sidebar.multiselect("Models to compare", model_options, default=model_options[:2])
 
+# Stop button: clicking interrupts the running script; cancelling closes the streams so Ollama stops decoding
+if st.sidebar.button("⏹ Stop generating") and "session_id" in st.session_state:
+    if GENERATIONS.cancel_session(st.session_state.session_id):
+        st.toast("Generation stopped")
 
 # Clear chat button
 if st.sidebar.button("🗑 Clear Chat"):
     st.session_state.messages = []
+    st.session_state.compare_histories = {}
 
 # Chat history (timestamps)
 st.sidebar.markdown("---")
@@ -29,6 +53,9 @@ if "messages" in st.session_state and st.session_state.messages:
 else:
     st.sidebar.caption("No conversation yet.")
 
+st.sidebar.markdown("---")
+render_metrics_panel(metrics, st.sidebar)
+
 st.sidebar.markdown("---")
 st.sidebar.markdown("**Local Chatbot Powered by Ollama**")
 st.sidebar.caption("Built with Streamlit 💙")
@@ -82,18 +109,174 @@ st.markdown("<div class='chat-title'>💬 Chatbot with Ollama</div>", unsafe_all
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# Per-model conversations for comparison mode, so follow-up turns stay parallel
+if "compare_histories" not in st.session_state:
+    st.session_state.compare_histories = {}
+
+# Identifies this browser session to the shared request scheduler
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# ---------------- Comparison Helpers ----------------
+def stream_chat_worker(model, messages, events, ticket, cancel):
+    """Stream one model's reply from /api/chat and push tokens and timings onto a queue"""
+    try:
+        # Waiting in short steps so a stopped or superseded comparison leaves the queue at once
+        with metrics.timer("queue_wait", model=model):
+            while not ticket.wait(0.25):
+                cancel.check()
+        # Timings start once the scheduler lets us in, so queueing doesn't skew the comparison
+        events.put(("started", model, None))
+        start = time.perf_counter()
+        cancel.check()
+        response = chat_request(model, messages, stream=True)
+        if response.status_code != 200:
+            events.put(("error", model, f"⚠ Error {response.status_code}: {response.text}"))
+            return
+        result = consume_stream(response, lambda token, _: events.put(("token", model, token)), cancel)
+        final, first_token_at, end = result["final"], result["first_token_at"], result["finished_at"]
+        metrics.record_ollama(final, source="compare")
+        metrics.record_stream(result, start, source="compare", model=model)
+        eval_count = final.get("eval_count", 0)
+        eval_duration = final.get("eval_duration", 0)  # nanoseconds
+        events.put(("done", model, {
+            "ttft": (first_token_at - start) if first_token_at else None,
+            "tokens_per_sec": eval_count / (eval_duration / 1e9) if eval_duration else None,
+            "total_latency": end - start,
+            "eval_count": eval_count
+        }))
+    except GenerationCancelled as e:
+        metrics.incr("generations_cancelled", reason=e.reason)
+        events.put(("error", model, f"⏹ Generation {e.reason}."))
+    except Exception as e:
+        events.put(("error", model, f"⚠ Exception: {str(e)}"))
+    finally:
+        ticket.release()
+
+def format_metrics(metrics):
+    """Format per-model latency metrics as a short caption"""
+    if not metrics:
+        return ""
+    ttft = f"{metrics['ttft']:.2f}s" if metrics.get("ttft") is not None else "n/a"
+    tps = f"{metrics['tokens_per_sec']:.1f}" if metrics.get("tokens_per_sec") is not None else "n/a"
+    return f"⏱ TTFT {ttft} • ⚡ {tps} tok/s • ⌛ total {metrics['total_latency']:.2f}s"
+
+def run_comparison(models, histories, results):
+    """Send each model its own history concurrently and stream the replies side by side.
+
+    Fills `results` (model -> {"content", "metrics"}) as replies finish. If the run
+    is interrupted, the unfinished replies are added with the text streamed so far.
+    """
+    events = queue.Queue()
+    columns = st.columns(len(models))
+    placeholders = {}
+    replies = {model: "" for model in models}
+    for col, model in zip(columns, models):
+        with col:
+            st.markdown(f"**{model}**")
+            placeholders[model] = st.empty()
+            placeholders[model].markdown("▌")
+
+    scheduler = get_scheduler()
+    # One token for the whole comparison: Stop, a newer message or the deadline cancels every model
+    cancel = GENERATIONS.begin(st.session_state.session_id, timeout=GENERATION_TIMEOUT)
+    tickets = {}
+    pending = set()
+    for model in models:
+        try:
+            tickets[model] = scheduler.submit(st.session_state.session_id)
+        except QueueFullError as e:
+            results[model] = {"content": f"⚠ {e}", "metrics": None}
+            placeholders[model].markdown(results[model]["content"])
+            continue
+        pending.add(model)
+        messages = chat_messages(histories[model])
+        threading.Thread(target=stream_chat_worker, args=(model, messages, events, tickets[model], cancel), daemon=True).start()
+
+    # Only this thread may touch Streamlit elements, so workers report through the queue.
+    # Each placeholder update is also a point where Streamlit can stop this run.
+    waiting = set(pending)
+    try:
+        while pending:
+            try:
+                kind, model, payload = events.get(timeout=0.5)
+            except queue.Empty:
+                cancel.poll()  # applies the deadline
+                for model in waiting:
+                    ticket = tickets[model]
+                    placeholders[model].info(f"⏳ Queue position {ticket.position()} • est. wait ~{ticket.estimated_wait():.0f}s")
+                for model in pending - waiting:
+                    placeholders[model].markdown(replies[model] + "▌")
+                continue
+            if kind == "started":
+                waiting.discard(model)
+                placeholders[model].markdown("▌")
+            elif kind == "token":
+                replies[model] += payload
+                placeholders[model].markdown(replies[model] + "▌")
+            elif kind == "done":
+                results[model] = {"content": replies[model], "metrics": payload}
+                placeholders[model].markdown(replies[model])
+                pending.discard(model)
+            else:
+                content = f"{replies[model]}\n\n{payload}" if replies[model] else payload
+                results[model] = {"content": content, "metrics": None}
+                placeholders[model].markdown(content)
+                pending.discard(model)
+    finally:
+        if pending:
+            cancel.cancel("stopped")  # this run was interrupted; free the model right away
+            for model in pending:
+                results[model] = {"content": f"{replies[model]}\n\n⏹ Generation stopped.".strip(), "metrics": None}
+        GENERATIONS.finish(st.session_state.session_id, cancel)
+
 # ---------------- Chat UI ----------------
-with st.container():
-    st.markdown("<div class='chat-container'>", unsafe_allow_html=True)
-    for m in st.session_state.messages:
-        role_class = "chat-bubble-user" if m["role"] == "user" else "chat-bubble-assistant"
-        st.markdown(f"<div class='{role_class}'>{m['content']}</div>", unsafe_allow_html=True)
-    st.markdown("</div>", unsafe_allow_html=True)
+if compare_mode and compare_models:
+    columns = st.columns(len(compare_models))
+    for col, model in zip(columns, compare_models):
+        with col:
+            st.markdown(f"**{model}**")
+            for m in st.session_state.compare_histories.get(model, []):
+                role_class = "chat-bubble-user" if m["role"] == "user" else "chat-bubble-assistant"
+                st.markdown(f"<div class='{role_class}'>{m['content']}</div>", unsafe_allow_html=True)
+                if m.get("metrics"):
+                    st.caption(format_metrics(m["metrics"]))
+else:
+    with st.container():
+        st.markdown("<div class='chat-container'>", unsafe_allow_html=True)
+        for m in st.session_state.messages:
+            role_class = "chat-bubble-user" if m["role"] == "user" else "chat-bubble-assistant"
+            st.markdown(f"<div class='{role_class}'>{m['content']}</div>", unsafe_allow_html=True)
+        st.markdown("</div>", unsafe_allow_html=True)
 
 # ---------------- Input ----------------
 user_input = st.chat_input("Type your message...")
 
-if user_input:
+if user_input and compare_mode and compare_models:
+    timestamp = datetime.now().strftime("%H:%M")
+    for model in compare_models:
+        # A model added mid-conversation starts from the shared single-model history
+        history = st.session_state.compare_histories.setdefault(
+            model, [dict(m) for m in st.session_state.messages]
+        )
+        history.append({"role": "user", "content": user_input, "timestamp": timestamp})
+
+    results = {}
+    try:
+        run_comparison(compare_models, st.session_state.compare_histories, results)
+    finally:
+        # Also runs when Stop or a newer message interrupts the comparison, so partial answers are kept
+        for model, result in results.items():
+            st.session_state.compare_histories[model].append({
+                "role": "assistant",
+                "content": result["content"],
+                "metrics": result["metrics"],
+                "timestamp": datetime.now().strftime("%H:%M")
+            })
+
+    st.rerun()
+
+elif user_input:
     # Add user message
     st.session_state.messages.append({
         "role": "user",
@@ -101,22 +284,58 @@ if user_input:
         "timestamp": datetime.now().strftime("%H:%M")
     })
 
-    # Send to Ollama
+    # Send to Ollama once the shared scheduler gives us a slot
+    router = get_router()
+    earlier = "\n".join(m["content"] for m in st.session_state.messages[:-1])
+    decision = router.route(user_input, earlier, app="chatbot_ollama1", model=MODEL_NAME)
+    streamed = {"text": ""}
+    reply = None
     try:
-        response = requests.post(
-            "http://localhost:11434/api/chat",
-            json={
-                "model": MODEL_NAME,
-                "messages": [{"role": m["role"], "content": m["content"]} for m in st.session_state.messages],
-                "stream": False
-            }
-        )
-        if response.status_code == 200:
-            reply = response.json()["message"]["content"]
-        else:
-            reply = "⚠ Error: Could not connect to local model."
+        messages = chat_messages(st.session_state.messages)
+        placeholder = st.empty()
+
+        def render(text):
+            streamed["text"] = text
+            placeholder.markdown(f"<div class='chat-bubble-assistant'>{text}▌</div>", unsafe_allow_html=True)
+
+        with metrics.timer("queue_wait"):
+            ticket = acquire_with_status(get_scheduler().submit(st.session_state.session_id), placeholder)
+        with ticket, metrics.timer("llm_request", source="chatbot_ollama1"):
+            start = time.perf_counter()
+            cancel = GENERATIONS.begin(st.session_state.session_id, timeout=GENERATION_TIMEOUT)
+            try:
+                result = stream_with_heartbeat(
+                    lambda: chat_request(decision.model, messages, stream=True),
+                    cancel,
+                    render
+                )
+            finally:
+                GENERATIONS.finish(st.session_state.session_id, cancel)
+        metrics.record_ollama(result["final"], source="chatbot_ollama1")
+        metrics.record_stream(result, start, source="chatbot_ollama1")
+        router.record(decision, result=result)
+        reply = result["text"]
+    except OllamaHTTPError:
+        router.record(decision, outcome="http_error")
+        reply = "⚠ Error: Could not connect to local model."
+    except GenerationCancelled as e:
+        router.record(decision, outcome="cancelled")
+        metrics.incr("generations_cancelled", reason=e.reason)
+        reply = f"{e.partial_text}\n\n⏹ Generation {e.reason}.".strip()
+    except QueueFullError as e:
+        reply = f"⚠ {str(e)}"
     except Exception as e:
         reply = f"⚠ Exception: {str(e)}"
+    finally:
+        if reply is None:
+            # Stop or a newer message ended this run mid-answer: keep what had streamed so far
+            router.record(decision, outcome="cancelled")
+            metrics.incr("generations_cancelled", reason="stopped")
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": f"{streamed['text']}\n\n⏹ Generation stopped.".strip(),
+                "timestamp": datetime.now().strftime("%H:%M")
+            })
 
     # Add assistant reply
     st.session_state.messages.append({
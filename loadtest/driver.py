@@ -0,0 +1,273 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+# Load-test driver: simulates N concurrent app sessions doing upload -> analysis -> chat,
+# using the apps' own prompt builders, summarizer, router, scheduler and Ollama client code.
+#
+#   python loadtest/driver.py --mock --sessions 20 --turns 3
+#   python loadtest/driver.py --url http://localhost:11435 --sessions 50 --app ocr1 --json report.json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+os.environ.setdefault("METRICS_TRACE_PATH", "")
+os.environ.setdefault("ROUTER_LOG_PATH", "")
+
+import ollama_client
+import ollama_scheduler
+from ollama_client import (chat_request, generate_request, consume_stream, GENERATIONS, GENERATION_TIMEOUT,
+                           GenerationCancelled)
+from ollama_scheduler import (get_scheduler, OllamaScheduler, QueueFullError, PRIORITY_INTERACTIVE,
+                              PRIORITY_BACKGROUND)
+from model_router import get_router, AUTO_MODEL
+from ocr_utils import detect_code_language
+from prompts import pdf_prompt, ocr_analysis_prompt, ocr_context_prompt, chat_messages, PDF_ANALYSIS_QUESTION
+from summarizer import condense_text
+from mock_ollama import MockConfig, start_mock_server
+
+QUESTIONS = [
+    "What does this code do?",
+    "Are there any bugs in it?",
+    "How could the main function be simplified?",
+    "Explain the second function line by line.",
+    "What would the output be for an empty list?",
+    "Suggest better variable names.",
+]
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = []
+
+    def add(self, **row):
+        with self.lock:
+            self.rows.append(row)
+
+
+def timed_request(recorder, session_id, kind, priority, decision, send):
+    """Queue, send and fully read one streamed request as the apps do; records timings.
+
+    `decision` comes from the router and `send(model)` must return a streaming response.
+    """
+    router = get_router()
+    submitted = time.perf_counter()
+    try:
+        ticket = get_scheduler().submit(session_id, priority)
+    except QueueFullError:
+        recorder.add(kind=kind, status="rejected", latency=0.0)
+        return None
+    with ticket:
+        started = time.perf_counter()
+        # Registered like an app request: a newer request from the session or the deadline cancels it
+        cancel = GENERATIONS.begin(session_id, timeout=GENERATION_TIMEOUT)
+        try:
+            response = send(decision.model)
+            if response.status_code != 200:
+                response.close()
+                router.record(decision, outcome="http_error")
+                recorder.add(kind=kind, status="error", queue_wait=started - submitted,
+                             latency=time.perf_counter() - submitted)
+                return None
+            result = consume_stream(response, cancel=cancel)
+        except GenerationCancelled:
+            router.record(decision, outcome="cancelled")
+            recorder.add(kind=kind, status="cancelled", queue_wait=started - submitted,
+                         latency=time.perf_counter() - submitted)
+            return None
+        except Exception:
+            recorder.add(kind=kind, status="error", queue_wait=started - submitted,
+                         latency=time.perf_counter() - submitted)
+            return None
+        finally:
+            GENERATIONS.finish(session_id, cancel)
+    router.record(decision, result=result)
+    first = result["first_token_at"]
+    recorder.add(
+        kind=kind, status="ok",
+        queue_wait=started - submitted,
+        ttft=(first - submitted) if first else None,
+        latency=result["finished_at"] - submitted,
+        tokens=result["final"].get("eval_count", 0),
+    )
+    return result["text"]
+
+
+def condense(recorder, session_id, text, kind):
+    """The apps' map-reduce step for long uploads; returns the analysis context, or None on failure"""
+    started = time.perf_counter()
+    try:
+        context = condense_text(text, session_id, kind=kind)
+    except Exception:
+        recorder.add(kind="condense", status="error", latency=time.perf_counter() - started)
+        return None
+    if context is not text:
+        recorder.add(kind="condense", status="ok", latency=time.perf_counter() - started)
+    return context
+
+
+def run_session(index, args, recorder, start_barrier):
+    rng = random.Random(f"{args.seed}-{index}")
+    session_id = f"session-{index}"
+    router = get_router()
+    start_barrier.wait()
+    time.sleep(rng.uniform(0, args.ramp))
+
+    # 1. Upload: extract text the way the app would
+    text = upload_text(rng, args)
+    code_language = detect_code_language(text)
+
+    # 2. Background analysis of the upload, condensed first if it is long (as pdf.py and ocr1.py do)
+    if args.app == "chatbot":
+        history = []
+    elif args.app == "pdf":
+        context = condense(recorder, session_id, text, "text")
+        if context:
+            decision = router.route(PDF_ANALYSIS_QUESTION, context, app="pdf", model=args.model)
+            timed_request(recorder, session_id, "analysis", PRIORITY_BACKGROUND, decision,
+                          lambda model: generate_request(model, pdf_prompt(PDF_ANALYSIS_QUESTION, context), stream=True))
+    else:
+        context = condense(recorder, session_id, text, "text" if code_language == "unknown" else "code")
+        if context:
+            prompt = ocr_analysis_prompt(context, code_language)
+            # ocr1 sends the analysis without OCR context, i.e. as a one-message chat
+            decision = router.route(prompt, "", app="ocr1", model=args.model)
+            timed_request(recorder, session_id, "analysis", PRIORITY_BACKGROUND, decision,
+                          lambda model: chat_request(model, [{"role": "user", "content": prompt}], stream=True))
+
+    # 3. Interactive follow-up questions with think time in between
+    for _ in range(args.turns):
+        time.sleep(rng.uniform(0.5, 1.5) * args.think_time)
+        question = rng.choice(QUESTIONS)
+        if args.app == "chatbot":
+            history.append({"role": "user", "content": question})
+            earlier = "\n".join(m["content"] for m in history[:-1])
+            decision = router.route(question, earlier, app="chatbot", model=args.model)
+            reply = timed_request(recorder, session_id, "chat", PRIORITY_INTERACTIVE, decision,
+                                  lambda model: chat_request(model, chat_messages(history), stream=True))
+            history.append({"role": "assistant", "content": reply or ""})
+        elif args.app == "pdf":
+            decision = router.route(question, text, app="pdf", model=args.model)
+            timed_request(recorder, session_id, "chat", PRIORITY_INTERACTIVE, decision,
+                          lambda model: generate_request(model, pdf_prompt(question, text), stream=True))
+        else:
+            decision = router.route(question, text, app="ocr1", model=args.model)
+            timed_request(recorder, session_id, "chat", PRIORITY_INTERACTIVE, decision,
+                          lambda model: generate_request(model, ocr_context_prompt(question, text), stream=True))
+
+
+def upload_text(rng, args):
+    from corpus import CODE_SNIPPETS, code_text
+    language = rng.choice(sorted(CODE_SNIPPETS))
+    if not args.ocr:
+        return code_text(language, repeat=args.upload_repeat)
+    from corpus import render_text_image
+    from ocr_utils import extract_text_from_image
+    return extract_text_from_image(render_text_image(code_text(language, repeat=args.upload_repeat), 20))
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def summarize(rows, wall_seconds):
+    report = {"wall_seconds": round(wall_seconds, 3), "kinds": {}}
+    for kind in sorted({r["kind"] for r in rows}):
+        subset = [r for r in rows if r["kind"] == kind]
+        ok = [r for r in subset if r["status"] == "ok"]
+        entry = {
+            "requests": len(subset),
+            "ok": len(ok),
+            "errors": sum(1 for r in subset if r["status"] == "error"),
+            "cancelled": sum(1 for r in subset if r["status"] == "cancelled"),
+            "rejected": sum(1 for r in subset if r["status"] == "rejected"),
+            "throughput_rps": round(len(ok) / wall_seconds, 3) if wall_seconds else None,
+            "tokens_per_sec": round(sum(r.get("tokens", 0) for r in ok) / wall_seconds, 1) if wall_seconds else None,
+        }
+        for metric in ("queue_wait", "ttft", "latency"):
+            values = [r[metric] for r in ok if r.get(metric) is not None]
+            entry[metric] = {f"p{int(q * 100)}": round(percentile(values, q), 3) if values else None
+                             for q in (0.5, 0.9, 0.95, 0.99)}
+        report["kinds"][kind] = entry
+    return report
+
+
+def print_report(report):
+    print(f"\nWall time: {report['wall_seconds']:.1f}s")
+    for kind, e in report["kinds"].items():
+        print(f"\n[{kind}] {e['ok']}/{e['requests']} ok, {e['errors']} errors, {e['cancelled']} cancelled, "
+              f"{e['rejected']} rejected, "
+              f"{e['throughput_rps']} req/s, {e['tokens_per_sec']} tok/s")
+        for metric in ("queue_wait", "ttft", "latency"):
+            p = e[metric]
+            print(f"  {metric:<11} p50={p['p50']}  p90={p['p90']}  p95={p['p95']}  p99={p['p99']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent session load test for the Ollama-backed apps")
+    parser.add_argument("--url", help="Ollama (or mock) base URL; defaults to OLLAMA_URL")
+    parser.add_argument("--mock", action="store_true", help="start an in-process mock server")
+    parser.add_argument("--app", choices=["pdf", "ocr1", "chatbot"], default="pdf")
+    parser.add_argument("--model", default=AUTO_MODEL, help='a model name, or "auto" to let model_router pick')
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--think-time", type=float, default=2.0, help="mean seconds between questions")
+    parser.add_argument("--ramp", type=float, default=2.0, help="sessions start spread over this many seconds")
+    parser.add_argument("--ocr", action="store_true", help="run real Tesseract OCR on a rendered upload")
+    parser.add_argument("--upload-repeat", type=int, default=1,
+                        help="repeat the uploaded snippet this many times; long uploads go through the summarizer")
+    parser.add_argument("--max-concurrent", type=int, default=2, help="scheduler slots, as in the apps")
+    parser.add_argument("--max-queue", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="write the report to this file")
+    # Mock server options (only with --mock)
+    parser.add_argument("--mock-tokens-per-sec", type=float, default=30.0)
+    parser.add_argument("--mock-prefill-ms", type=float, default=100.0)
+    parser.add_argument("--mock-response-tokens", type=int, default=60)
+    parser.add_argument("--mock-error-rate", type=float, default=0.0)
+    parser.add_argument("--mock-max-concurrent", type=int, default=0)
+    args = parser.parse_args()
+
+    server = None
+    if args.mock:
+        config = MockConfig(prefill_ms=args.mock_prefill_ms, tokens_per_sec=args.mock_tokens_per_sec,
+                            response_tokens=args.mock_response_tokens, error_rate=args.mock_error_rate,
+                            max_concurrent=args.mock_max_concurrent, seed=args.seed)
+        server, url = start_mock_server(config)
+        ollama_client.OLLAMA_URL = url
+    elif args.url:
+        ollama_client.OLLAMA_URL = args.url.rstrip("/")
+    print(f"Target: {ollama_client.OLLAMA_URL} • app={args.app} • sessions={args.sessions} • turns={args.turns}")
+
+    # Installed as the process-wide scheduler so the summarizer's chunk requests queue in it too
+    ollama_scheduler._scheduler = OllamaScheduler(max_concurrent=args.max_concurrent, max_queue=args.max_queue,
+                                                  max_queued_per_session=args.max_queue)
+    recorder = Recorder()
+    barrier = threading.Barrier(args.sessions + 1)
+    threads = [threading.Thread(target=run_session, args=(i, args, recorder, barrier), daemon=True)
+               for i in range(args.sessions)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    report = summarize(recorder.rows, time.perf_counter() - started)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the Ollama HTTP API, for load tests without a GPU.
+#
+#   python loadtest/mock_ollama.py --port 11435 --tokens-per-sec 40 --prefill-ms 150
+#   OLLAMA_URL=http://localhost:11435 streamlit run pdf.py
+#
+# Streams NDJSON like the real server and reports the same timing fields
+# (total_duration, load_duration, prompt_eval_count/duration, eval_count/duration).
+
+WORDS = ("the code defines a function that reads input values and returns the result "
+         "after checking each item in the list for errors").split()
+
+
+class MockConfig:
+    def __init__(self, prefill_ms=100.0, prefill_ms_per_1k_tokens=200.0, tokens_per_sec=30.0,
+                 response_tokens=80, error_rate=0.0, drop_rate=0.0, max_concurrent=0, seed=None):
+        self.prefill_ms = prefill_ms
+        self.prefill_ms_per_1k_tokens = prefill_ms_per_1k_tokens
+        self.tokens_per_sec = tokens_per_sec
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.max_concurrent = max_concurrent
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        # Emulates a GPU that can only decode a few sequences at once
+        self.slots = threading.Semaphore(max_concurrent) if max_concurrent else None
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "completed": 0, "errors": 0, "dropped": 0, "cancelled": 0, "tokens": 0}
+
+    def roll(self):
+        with self.rng_lock:
+            return self.rng.random()
+
+    def count(self, key, value=1):
+        with self.stats_lock:
+            self.stats[key] += value
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token), good enough for timing"""
+    return max(1, len(text) // 4)
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json({"models": [{"name": "llama3.2:1b"}, {"name": "llama3.1:8b"}]})
+            elif self.path == "/stats":
+                with config.stats_lock:
+                    self._send_json(dict(config.stats))
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            if self.path not in ("/api/generate", "/api/chat"):
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            config.count("requests")
+
+            if config.roll() < config.error_rate:
+                config.count("errors")
+                self._send_json({"error": "injected failure"}, status=500)
+                return
+
+            if config.slots:
+                config.slots.acquire()
+            try:
+                self._respond(body)
+            finally:
+                if config.slots:
+                    config.slots.release()
+
+        def _respond(self, body):
+            is_chat = self.path == "/api/chat"
+            model = body.get("model", "llama3.2:1b")
+            if is_chat:
+                prompt_text = "".join(m.get("content", "") for m in body.get("messages", []))
+            else:
+                prompt_text = body.get("prompt", "")
+            prompt_tokens = estimate_tokens(prompt_text)
+            started = time.perf_counter()
+
+            prefill = (config.prefill_ms + config.prefill_ms_per_1k_tokens * prompt_tokens / 1000) / 1000
+            time.sleep(prefill)
+            prefill_done = time.perf_counter()
+
+            stream = body.get("stream", True)
+            drop_at = None
+            if stream and config.roll() < config.drop_rate:
+                drop_at = int(config.roll() * config.response_tokens)
+
+            if stream:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+            tokens = []
+            interval = 1.0 / config.tokens_per_sec if config.tokens_per_sec else 0
+            try:
+                for i in range(config.response_tokens):
+                    if drop_at is not None and i == drop_at:
+                        config.count("dropped")
+                        self.close_connection = True
+                        return
+                    time.sleep(interval)
+                    token = WORDS[i % len(WORDS)] + " "
+                    tokens.append(token)
+                    if stream:
+                        self._write_chunk(self._chunk(is_chat, model, token, done=False))
+                eval_done = time.perf_counter()
+                final = self._chunk(is_chat, model, "" if stream else "".join(tokens), done=True)
+                final.update({
+                    "total_duration": int((eval_done - started) * 1e9),
+                    "load_duration": 0,
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int((prefill_done - started) * 1e9),
+                    "eval_count": len(tokens),
+                    "eval_duration": int((eval_done - prefill_done) * 1e9),
+                })
+                if stream:
+                    self._write_chunk(final)
+                    self.wfile.write(b"0\r\n\r\n")
+                else:
+                    self._send_json(final)
+                config.count("completed")
+                config.count("tokens", len(tokens))
+            except (BrokenPipeError, ConnectionResetError):
+                # Client went away: stop decoding, like Ollama does
+                config.count("cancelled")
+                self.close_connection = True
+
+        def _chunk(self, is_chat, model, token, done):
+            chunk = {"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "done": done}
+            if is_chat:
+                chunk["message"] = {"role": "assistant", "content": token}
+            else:
+                chunk["response"] = token
+            return chunk
+
+        def _write_chunk(self, obj):
+            data = (json.dumps(obj) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def _send_json(self, obj, status=200):
+            data = json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-stream is expected under load; don't print tracebacks for it
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def start_mock_server(config, host="127.0.0.1", port=0):
+    """Start the mock on a background thread; returns (server, base_url)"""
+    server = MockServer((host, port), make_handler(config))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Ollama server for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--prefill-ms", type=float, default=100.0, help="fixed delay before the first token")
+    parser.add_argument("--prefill-ms-per-1k-tokens", type=float, default=200.0, help="extra prefill per 1k prompt tokens")
+    parser.add_argument("--tokens-per-sec", type=float, default=30.0)
+    parser.add_argument("--response-tokens", type=int, default=80)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of streams cut off mid-response")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="decode slots (0 = unlimited)")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    config = MockConfig(args.prefill_ms, args.prefill_ms_per_1k_tokens, args.tokens_per_sec, args.response_tokens,
+                        args.error_rate, args.drop_rate, args.max_concurrent, args.seed)
+    server = MockServer((args.host, args.port), make_handler(config))
+    print(f"Mock Ollama listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
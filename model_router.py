@@ -0,0 +1,168 @@
+import json
+import os
+import re
+import threading
+import time
+from ocr_utils import detect_code_language
+from perf_metrics import get_metrics
+
+# Picks the cheapest local model that should handle a request well.
+#
+# Each request is scored from cheap features (prompt + context size, whether the
+# context or question is code, and the kind of question). The score selects a
+# tier in MODEL_TIERS, cheapest first. Optionally, a weak answer from a small
+# model is retried one tier up. Every decision is appended to ROUTER_LOG_PATH
+# together with its latency and token counts, so the thresholds can be tuned
+# against real traffic.
+
+# ------------------ Config ------------------
+# Installed models, cheapest first
+MODEL_TIERS = [m.strip() for m in os.environ.get("OLLAMA_MODEL_TIERS", "llama3.2:1b,llama3.1:8b").split(",") if m.strip()]
+# Score points per tier step: 0-1 -> first tier, 2-3 -> second, ...
+TIER_STEP = 2
+# Above this many estimated tokens the small model tends to lose track of the context
+LARGE_CONTEXT_TOKENS = 1500
+# JSONL log of decisions and outcomes; set ROUTER_LOG_PATH="" to turn it off
+LOG_PATH = os.environ.get("ROUTER_LOG_PATH", "router_decisions.jsonl")
+# Pick this in a model selectbox to let the router choose
+AUTO_MODEL = "auto"
+
+QUESTION_TYPES = [
+    ("debug", re.compile(r"\b(bug|debug|error|exception|traceback|fix|crash|fail\w*|wrong)\b", re.I)),
+    ("refactor", re.compile(r"\b(refactor|optimi[sz]e|improve|simplif\w*|rewrite|complexity|performance|faster)\b", re.I)),
+    ("reasoning", re.compile(r"\b(why|explain|compare|difference|how does|how do|line by line|step by step|prove)\b", re.I)),
+    ("summary", re.compile(r"\b(summar\w*|what is it about|overview|key points|tl;?dr|translate|list)\b", re.I)),
+    ("smalltalk", re.compile(r"^\s*(hi|hello|hey|thanks?|thank you|ok(ay)?|bye|good (morning|evening))\b", re.I)),
+]
+QUESTION_TYPE_POINTS = {"debug": 2, "refactor": 2, "reasoning": 1, "summary": 0, "smalltalk": -2, "other": 0}
+
+# Signs that a small model didn't manage the question
+WEAK_ANSWER = re.compile(r"\b(i'?m not sure|i don'?t know|i cannot|i can'?t (help|determine|tell)|unable to|not enough information)\b", re.I)
+
+metrics = get_metrics()
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token)"""
+    return len(text) // 4
+
+
+def question_type(question):
+    for name, pattern in QUESTION_TYPES:
+        if pattern.search(question):
+            return name
+    return "other"
+
+
+class RouteDecision:
+    """The model chosen for one request and why"""
+
+    def __init__(self, app, model, tier, score, features, escalated_from=None, manual=False):
+        self.app = app
+        self.model = model
+        self.tier = tier
+        self.score = score
+        self.features = features
+        self.escalated_from = escalated_from
+        self.manual = manual  # picked by the user; logged for comparison, never escalated
+        self.started = time.perf_counter()
+
+    def as_dict(self):
+        return {"app": self.app, "model": self.model, "tier": self.tier, "score": self.score,
+                "manual": self.manual, "escalated_from": self.escalated_from, **self.features}
+
+
+class ModelRouter:
+    """Scores requests and maps them to MODEL_TIERS; thread-safe, shared by all sessions"""
+
+    def __init__(self, tiers=None, log_path=LOG_PATH):
+        self.tiers = list(tiers or MODEL_TIERS)
+        self.log_path = log_path
+        self._lock = threading.Lock()
+
+    def features(self, question, context=""):
+        """Cheap request features; no model calls"""
+        code_language = detect_code_language(context or question)
+        return {
+            "question_type": question_type(question),
+            "code_language": code_language,
+            "context_tokens": estimate_tokens(context),
+            "prompt_tokens": estimate_tokens(question),
+        }
+
+    def score(self, features):
+        points = QUESTION_TYPE_POINTS[features["question_type"]]
+        if features["code_language"] != "unknown":
+            points += 1
+        if features["context_tokens"] + features["prompt_tokens"] > LARGE_CONTEXT_TOKENS:
+            points += 1
+        return points
+
+    def route(self, question, context="", app="", model=None):
+        """Choose the cheapest adequate model for a request.
+
+        Pass `model` (anything but AUTO_MODEL) to keep a manual choice; it is
+        still scored and logged so manual and routed traffic can be compared.
+        """
+        features = self.features(question, context)
+        points = self.score(features)
+        if model and model != AUTO_MODEL:
+            tier = self.tiers.index(model) if model in self.tiers else -1
+            decision = RouteDecision(app, model, tier, points, features, manual=True)
+        else:
+            tier = min(len(self.tiers) - 1, max(0, points) // TIER_STEP)
+            decision = RouteDecision(app, self.tiers[tier], tier, points, features)
+        metrics.incr("router_decisions", model=decision.model, app=app, question_type=features["question_type"])
+        return decision
+
+    def should_escalate(self, decision, answer):
+        """True if a weak answer should be retried on the next tier"""
+        if decision.manual or decision.tier >= len(self.tiers) - 1:
+            return False
+        answer = answer.strip()
+        if not answer or WEAK_ANSWER.search(answer[:300]):
+            return True
+        # A non-trivial question answered in a sentence fragment
+        return decision.score > 0 and len(answer) < 40
+
+    def escalate(self, decision):
+        """The same request routed one tier up"""
+        tier = decision.tier + 1
+        escalated = RouteDecision(decision.app, self.tiers[tier], tier, decision.score, decision.features,
+                                  escalated_from=decision.model)
+        metrics.incr("router_escalations", model=escalated.model, app=decision.app)
+        return escalated
+
+    def record(self, decision, outcome="ok", result=None):
+        """Log a finished request: its decision, latency and Ollama's token counts"""
+        latency = time.perf_counter() - decision.started
+        metrics.observe("routed_request", latency, model=decision.model, app=decision.app)
+        if not self.log_path:
+            return
+        final = (result or {}).get("final") or {}
+        first = (result or {}).get("first_token_at")
+        entry = {
+            "ts": round(time.time(), 3),
+            **decision.as_dict(),
+            "outcome": outcome,
+            "latency": round(latency, 3),
+            "ttft": round(first - decision.started, 3) if first else None,
+            "prompt_eval_count": final.get("prompt_eval_count"),
+            "eval_count": final.get("eval_count"),
+        }
+        with self._lock:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """Return the shared router for this process"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
@@ -1,86 +1,92 @@
 import streamlit as st
-from PIL import Image
-import pytesseract
 from datetime import datetime
-import requests
 import re
+import time
+import uuid
+from app_core import inject_css, init_session_state, fragment, polling_fragment, start_run_timer, finish_run_timer
+from perf_metrics import get_metrics, render_metrics_panel
+from ocr_utils import (detect_code_language, extract_text_from_image, prepare_ocr_image, document_key,
+                       cached_language, ImageTooLargeError, AUTO_LANG)
+from summarizer import condense_text
+from prompts import ocr_analysis_prompt, ocr_context_prompt
+from artifact_store import get_store
+from prefetch import PREFETCHER, parse_suggested_questions
+from model_router import get_router, AUTO_MODEL, MODEL_TIERS
+from ollama_client import (chat_request, generate_request, stream_with_heartbeat, DEFAULT_MODEL, GENERATIONS,
+                           GENERATION_TIMEOUT, GenerationCancelled, OllamaHTTPError, OllamaUnavailableError)
+from ollama_scheduler import (get_scheduler, acquire_with_status, QueueFullError,
+                              PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND)
 
 # ------------------ Config ------------------
+run_started = start_run_timer()
 st.set_page_config(page_title="OCR + Chatbot", layout="wide", page_icon="🤖")
 
 # Tesseract path
-# IMPORTANT: Make sure this path is correct for your installation.
-# If Tesseract is in your system's PATH, you might not need this line.
-try:
-    pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-except pytesseract.TesseractNotFoundError:
-    st.warning("Tesseract is not installed or not in your PATH. Please install Tesseract OCR.")
-    # You might want to exit or disable OCR functionality here if Tesseract is critical.
+# IMPORTANT: Set TESSERACT_CMD (see ocr_utils.py) if Tesseract isn't installed in
+# the default Windows location or on your PATH. It is applied on first OCR use.
 
-# ------------------ Initialize session states ------------------
-if "ocr_history" not in st.session_state:
-    st.session_state.ocr_history = []
-
-if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
-
-if "user_input" not in st.session_state:
-    st.session_state.user_input = ""
-
-if "uploaded_file" not in st.session_state:
-    st.session_state.uploaded_file = None
+metrics = get_metrics()
+# Extracted text, code and uploads live here; session state only keeps references
+store = get_store()
 
-if "current_ocr_text" not in st.session_state:
-    st.session_state.current_ocr_text = ""
+# History entries shown in the sidebar before "Show all" is ticked
+SIDEBAR_HISTORY_LIMIT = 10
 
-if "conversation_context" not in st.session_state:
-    st.session_state.conversation_context = []
-
-if "extracted_code" not in st.session_state:
-    st.session_state.extracted_code = ""
-
-if "code_language" not in st.session_state:
-    st.session_state.code_language = "python"
+# ------------------ Initialize session states ------------------
+init_session_state({
+    "ocr_history": list,
+    "chat_history": list,
+    "user_input": "",
+    "uploaded_file_id": None,
+    "current_ocr_ref": None,
+    "conversation_context": list,
+    "extracted_code_ref": None,
+    "code_language": "python",
+    "stored_files": list,  # {"filename", "ref"} for export
+    "suggested_questions": list,  # follow-ups parsed from the latest analysis
+    "session_id": lambda: uuid.uuid4().hex,  # key for the shared request scheduler
+})
+
+# File extensions for downloaded code
+CODE_EXTENSIONS = {"python": "py", "javascript": "js", "java": "java", "cpp": "cpp"}
 
 # ------------------ Helper Functions ------------------
-def detect_code_language(text):
-    """Detect programming language from extracted text"""
-    text_lower = text.lower()
-    
-    # Python keywords and patterns
-    python_patterns = ['def ', 'import ', 'from ', 'class ', 'if __name__', 'print(', '.py', 'import numpy', 'import pandas', 'from sklearn']
-    # JavaScript patterns  
-    js_patterns = ['function ', 'var ', 'let ', 'const ', 'console.log', '.js', 'import ', 'export ']
-    # Java patterns
-    java_patterns = ['public class', 'public static void main', 'System.out.', '.java', 'import java.']
-    # C++ patterns
-    cpp_patterns = ['#include', 'using namespace', 'cout <<', '.cpp', '.h', 'std::cout']
-    
-    # Assign higher scores to more specific patterns
-    scores = {
-        'python': sum(1 for pattern in python_patterns if pattern in text_lower) * 2,
-        'javascript': sum(1 for pattern in js_patterns if pattern in text_lower) * 1.5,
-        'java': sum(1 for pattern in java_patterns if pattern in text_lower) * 1.8,
-        'cpp': sum(1 for pattern in cpp_patterns if pattern in text_lower) * 1.7
-    }
-    
-    detected_lang = max(scores, key=scores.get)
-    
-    # Only return a language if the score is significant enough to avoid false positives
-    return detected_lang if scores[detected_lang] > 1 else 'unknown'
+def load_artifact(ref):
+    """Stored text for a reference ("" if there is none or it has expired, with an error shown)"""
+    if not ref:
+        return ""
+    try:
+        return store.get_text(ref)
+    except KeyError:
+        metrics.incr("artifact_missing")
+        st.error("⚠ Stored content from this session is no longer available. Please upload the file again.")
+        # Don't keep sending an empty context or offering empty code
+        for key in ("current_ocr_ref", "extracted_code_ref"):
+            if st.session_state.get(key) == ref:
+                st.session_state[key] = None
+        return ""
+
+def current_ocr_text():
+    """Text of the latest OCR extraction"""
+    return load_artifact(st.session_state.current_ocr_ref)
+
+def store_file(filename, data, compress=True):
+    """Write content to the artifact store and list it for export"""
+    ref = store.put(data, compress=compress)
+    st.session_state.stored_files.append({"filename": filename, "ref": ref})
+    return ref
 
 def save_code_temporarily(code, language="python"):
     """Save extracted code to temporary storage"""
-    st.session_state.extracted_code = code
-    st.session_state.code_language = language
-    
-    # Also save to a temporary file-like structure
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"extracted_code_{timestamp}.{language}"
+    filename = f"extracted_code_{timestamp}.{CODE_EXTENSIONS.get(language, 'txt')}"
+    
+    st.session_state.extracted_code_ref = store_file(filename, code)
+    st.session_state.code_language = language
     
     return {
         "filename": filename,
-        "code": code,
+        "ref": st.session_state.extracted_code_ref,
         "language": language,
         "timestamp": timestamp,
         "line_count": len(code.split('\n'))
@@ -101,236 +107,286 @@ Please provide:
 
 Keep your response informative but concise (4-6 sentences)."""
     
-    return get_ollama_response(analysis_prompt, use_context=False)
-
-def get_ollama_response(prompt, use_context=False):
-    """Get response from Ollama with optional context"""
+    return get_ollama_response(analysis_prompt, use_context=False, priority=PRIORITY_BACKGROUND)
+
+def route_request(prompt, use_context, app="ocr1"):
+    """Pick the model: the sidebar choice, or the router's when it is set to auto"""
+    context = current_ocr_text() if use_context else ""
+    choice = st.session_state.get("model_choice", AUTO_MODEL)
+    return get_router().route(prompt, context, app=app, model=choice)
+
+def get_ollama_response(prompt, use_context=False, priority=PRIORITY_INTERACTIVE, streamed=None):
+    """Get response from Ollama with optional context (the text so far is kept in streamed["text"] if given)"""
+    streamed = streamed if streamed is not None else {}
+    streamed["text"] = ""
+    router = get_router()
+    decision = route_request(prompt, use_context)
     try:
-        if use_context and st.session_state.current_ocr_text:
-            # Include OCR context in the conversation
-            context_prompt = f"""You are having a conversation about this extracted text from an image:
-
-EXTRACTED TEXT:
-{st.session_state.current_ocr_text}
-
-Please answer the following question in context of this extracted text:
-{prompt}
-
-If the question is not related to the extracted text, you can answer generally but try to relate it back to the extracted text when possible.
-Respond concisely."""
+        while True:
+            send = _post_to_ollama(prompt, use_context, decision.model)
+            placeholder = st.empty()
+            # Wait for the shared scheduler before touching the model server
+            with metrics.timer("queue_wait"):
+                ticket = acquire_with_status(get_scheduler().submit(st.session_state.session_id, priority), placeholder)
+
+            def render(text):
+                streamed["text"] = text
+                placeholder.caption((text[-300:] if text else "⏳ Waiting for the model...") + "▌")
+
+            with ticket, metrics.timer("llm_request", source="ocr1"):
+                # Streamed so a Stop click, a newer request or the deadline can close it mid-answer
+                start = time.perf_counter()
+                cancel = GENERATIONS.begin(st.session_state.session_id, timeout=GENERATION_TIMEOUT)
+                try:
+                    result = stream_with_heartbeat(
+                        send, cancel, render
+                    )
+                finally:
+                    GENERATIONS.finish(st.session_state.session_id, cancel)
+            placeholder.empty()
             
-            response = requests.post(
-                "http://localhost:11434/api/generate", # Ensure Ollama is running and accessible
-                json={
-                    "model": "llama3.2:1b", # Or your preferred Ollama model
-                    "prompt": context_prompt,
-                    "stream": False
-                }
-            )
-        else:
-            # Regular chat without specific OCR context
-            # For chat, we might want to pass the conversation history to Ollama
-            # For simplicity here, we're sending just the current prompt.
-            # A more robust chatbot would manage the conversation history.
-            messages = [{"role": "user", "content": prompt}]
-            # If you have past chat history to send:
-            # for chat_entry in st.session_state.chat_history:
-            #     if chat_entry["role"] != "system" and chat_entry["role"] != "analysis" and chat_entry["role"] != "ocr":
-            #         messages.append({"role": chat_entry["role"], "content": chat_entry["message"]})
-
-            response = requests.post(
-                "http://localhost:11434/api/chat", # Ensure Ollama is running and accessible
-                json={
-                    "model": "llama3.2:1b", # Or your preferred Ollama model
-                    "messages": messages,
-                    "stream": False
-                }
-            )
-        
-        if response.status_code == 200:
-            data = response.json()
-            if use_context:
-                reply = data.get("response") or str(data)
-            else:
-                reply = data.get("message", {}).get("content") or str(data)
-            reply = re.sub(r"<.*?>", "", reply) # Clean up any stray HTML tags
-            return reply
-        else:
-            return f"⚠ Error {response.status_code}: Could not connect to Ollama. Please ensure Ollama is running and the model is available. Response: {response.text}"
-    except requests.exceptions.ConnectionError:
-        return "⚠ Error: Could not connect to Ollama. Please ensure Ollama is running on http://localhost:11434."
+            metrics.record_ollama(result["final"], source="ocr1")
+            metrics.record_stream(result, start, source="ocr1")
+            router.record(decision, result=result)
+            reply = re.sub(r"<.*?>", "", result["text"]) # Clean up any stray HTML tags
+            # Optionally give a weak (or empty) answer from a small model a second try one size up
+            if st.session_state.get("escalate_answers") and router.should_escalate(decision, reply):
+                decision = router.escalate(decision)
+                continue
+            return reply if reply.strip() else f"⚠ {decision.model} returned an empty answer. Please try again."
+    except OllamaHTTPError as e:
+        router.record(decision, outcome="http_error")
+        return f"⚠ Error {e.status_code}: Could not connect to Ollama. Please ensure Ollama is running and the model is available. Response: {e.text}"
+    except GenerationCancelled as e:
+        router.record(decision, outcome="cancelled")
+        metrics.incr("generations_cancelled", reason=e.reason)
+        partial = re.sub(r"<.*?>", "", e.partial_text)
+        return f"{partial}\n\n⏹ Generation {e.reason}.".strip()
+    except QueueFullError as e:
+        return f"⚠ {str(e)}"
+    except OllamaUnavailableError as e:
+        return f"⚠ Error: {e}. Please ensure Ollama is running."
     except Exception as e:
         return f"⚠ Exception: {str(e)}"
+    except BaseException:
+        # Stop or a newer request ended this script run mid-answer; the caller keeps the partial text
+        router.record(decision, outcome="cancelled")
+        metrics.incr("generations_cancelled", reason="stopped")
+        raise
+
+def stopped_reply(streamed):
+    """What is kept in the chat history when a run is interrupted mid-answer"""
+    return f"{re.sub(r'<.*?>', '', streamed.get('text', ''))}\n\n⏹ Generation stopped.".strip()
+
+def _post_to_ollama(prompt, use_context, model=DEFAULT_MODEL):
+    """Build the /api/generate (with OCR context) or /api/chat call; returns a function that sends it"""
+    if use_context and st.session_state.current_ocr_ref:
+        # Include OCR context in the conversation
+        prompt_start = time.perf_counter()
+        context_prompt = ocr_context_prompt(prompt, current_ocr_text())
+        metrics.observe("prompt_build", time.perf_counter() - prompt_start)
+        
+        return lambda: generate_request(model, context_prompt, stream=True) # Ensure Ollama is running and accessible
+    else:
+        # Regular chat without specific OCR context
+        # For chat, we might want to pass the conversation history to Ollama
+        # For simplicity here, we're sending just the current prompt.
+        # A more robust chatbot would manage the conversation history.
+        messages = [{"role": "user", "content": prompt}]
+        # If you have past chat history to send:
+        # for chat_entry in st.session_state.chat_history:
+        #     if chat_entry["role"] != "system" and chat_entry["role"] != "analysis" and chat_entry["role"] != "ocr":
+        #         messages.append({"role": chat_entry["role"], "content": chat_entry["message"]})
+
+        return lambda: chat_request(model, messages, stream=True) # Ensure Ollama is running and accessible
+
+def condense_for_analysis(text, kind):
+    """Map-reduce long text into section summaries; returns (context, error message)"""
+    progress = st.empty()
+    try:
+        context = condense_text(text, st.session_state.session_id, kind=kind,
+                                on_progress=lambda done, total: progress.caption(f"📚 Summarising long text: {done}/{total} sections"))
+        return context, None
+    except GenerationCancelled as e:
+        metrics.incr("generations_cancelled", reason=e.reason)
+        return None, f"⏹ Generation {e.reason}."
+    except Exception as e:
+        return None, f"⚠ Exception: {str(e)}"
+    finally:
+        progress.empty()
+
+def start_prefetch(questions, use_context):
+    """Answer the suggested questions in the background, built exactly as a click would send them"""
+    jobs = []
+    for question in questions:
+        # Routed and logged as their own app, so speculative traffic can be told apart
+        decision = route_request(question, use_context, app="ocr1_prefetch")
+        jobs.append((question, _post_to_ollama(question, use_context, decision.model), decision))
+    PREFETCHER.start(st.session_state.session_id, jobs)
+
+def render_suggested_questions(speculative):
+    """One-click follow-up questions from the latest analysis"""
+    questions = st.session_state.suggested_questions
+    if not questions:
+        return
+    st.caption("💡 Suggested questions" + (" • ⚡ answer ready" if speculative else ""))
+    for i, question in enumerate(questions):
+        ready = speculative and PREFETCHER.ready(st.session_state.session_id, question)
+        if st.button(("⚡ " if ready else "") + question, key=f"suggested_question_{i}"):
+            st.session_state.queued_question = question
+            st.rerun()
 
 # ------------------ Sidebar ------------------
-st.sidebar.title("Settings & History")
-
-# OCR Settings
-st.sidebar.subheader("OCR Settings")
-# Added more common languages, but ensure Tesseract has them installed
-languages = ["eng", "fra", "deu", "spa", "chi_sim", "jpn", "kor"] 
-lang_choice = st.sidebar.selectbox("Select OCR Language", languages, index=0)
-
-# Show current extracted code if available
-if st.session_state.extracted_code:
-    st.sidebar.markdown("---")
-    st.sidebar.subheader("💾 Extracted Code")
-    st.sidebar.text(f"Language: {st.session_state.code_language.upper()}")
-    st.sidebar.text(f"Lines: {len(st.session_state.extracted_code.split('\\n'))}")
+@fragment
+def sidebar_extracted_code():
+    """Stored code panel; Copy only reruns this fragment"""
+    if not st.session_state.extracted_code_ref:
+        return
+    code = load_artifact(st.session_state.extracted_code_ref)
+    language = st.session_state.code_language
+    st.markdown("---")
+    st.subheader("💾 Extracted Code")
+    st.text(f"Language: {language.upper()}")
+    st.text(f"Lines: {len(code.splitlines())}")
     
-    with st.sidebar.expander("View Code"):
-        st.code(st.session_state.extracted_code, language=st.session_state.code_language)
+    with st.expander("View Code"):
+        st.code(code, language=language)
     
-    if st.sidebar.button("📋 Copy Code", key="copy_code_btn"):
+    if st.button("📋 Copy Code", key="copy_code_btn"):
         st.toast("Code copied to session!") # Use toast for brief feedback
     
-    if st.sidebar.button("🗑 Clear Extracted Code", key="clear_code_btn"):
-        st.session_state.extracted_code = ""
+    st.download_button("⬇ Download Code", data=code, file_name=f"extracted_code.{CODE_EXTENSIONS.get(language, 'txt')}",
+                       mime="text/plain", key="download_code_btn")
+    
+    if st.button("🗑 Clear Extracted Code", key="clear_code_btn"):
+        st.session_state.extracted_code_ref = None
         st.session_state.code_language = "python"
         st.rerun() # Rerun to clear sidebar section
 
-# Show current OCR text if available
-if st.session_state.current_ocr_text:
-    st.sidebar.markdown("---")
-    st.sidebar.subheader("Current OCR Text")
-    st.sidebar.text_area("Extracted Text", value=st.session_state.current_ocr_text, height=100, disabled=True)
-    if st.sidebar.button("🗑 Clear Current OCR", key="clear_ocr_btn"):
-        st.session_state.current_ocr_text = ""
-        st.session_state.conversation_context = [] # Clear context if OCR is cleared
-        st.rerun() # Rerun to clear sidebar section
-
-st.sidebar.markdown("---")
-st.sidebar.subheader("OCR History")
-if st.session_state.ocr_history:
-    for entry in st.session_state.ocr_history[::-1]:
-        st.sidebar.markdown(f"**{entry['timestamp']}** ({entry['filename']})")
-        st.sidebar.caption(entry['text'][:60] + ("..." if len(entry['text']) > 60 else ""))
-else:
-    st.sidebar.caption("No OCR history yet.")
-
-if st.sidebar.button("🗑 Clear OCR History", key="clear_ocr_history_btn"):
-    st.session_state.ocr_history = []
-    st.rerun() # Rerun to update sidebar
-
-# Chatbot Settings
-st.sidebar.markdown("---")
-st.sidebar.subheader("Chatbot Settings")
-# model_choice = "llama3.2:1b" # Currently hardcoded in get_ollama_response
-context_mode = st.sidebar.checkbox("Use OCR Context in Chat", value=True, 
-                                   help="When enabled, the chatbot will consider the extracted OCR text in all responses")
-
-st.sidebar.markdown("---")
-st.sidebar.subheader("Chat History")
-if st.session_state.chat_history:
-    for chat in st.session_state.chat_history[::-1]:
-        role_icon = "🧑" if chat["role"] == "user" else "🤖"
-        # Only show relevant parts for brevity in sidebar
-        display_message = chat["message"]
-        if "\n\n" in display_message: # Truncate code blocks for sidebar
-            display_message = display_message.split("\n\n")[0] + "..."
-        elif len(display_message) > 60:
-            display_message = display_message[:60] + "..."
-
-        st.sidebar.markdown(f"{role_icon} **{chat['role'].capitalize()}** ({chat['timestamp']})")
-        st.sidebar.caption(display_message)
-else:
-    st.sidebar.caption("No chat history yet.")
-
-if st.sidebar.button("🗑 Clear Chat History", key="clear_chat_btn"):
-    st.session_state.chat_history = []
-    st.rerun() # Rerun to update sidebar
+@fragment
+def sidebar_ocr_history():
+    """Past OCR extractions; "Show all" only reruns this fragment"""
+    st.subheader("OCR History")
+    if st.session_state.ocr_history:
+        entries = st.session_state.ocr_history[::-1]
+        if len(entries) > SIDEBAR_HISTORY_LIMIT and not st.checkbox("Show all", key="ocr_history_show_all"):
+            entries = entries[:SIDEBAR_HISTORY_LIMIT]
+        for entry in entries:
+            st.markdown(f"**{entry['timestamp']}** ({entry['filename']})")
+            st.caption(entry['preview'])
+    else:
+        st.caption("No OCR history yet.")
+    
+    if st.button("🗑 Clear OCR History", key="clear_ocr_history_btn"):
+        st.session_state.ocr_history = []
+        st.rerun() # Rerun to update sidebar
+
+@fragment
+def sidebar_chat_history():
+    """Past chat messages; "Show all" only reruns this fragment"""
+    st.subheader("Chat History")
+    if st.session_state.chat_history:
+        chats = st.session_state.chat_history[::-1]
+        if len(chats) > SIDEBAR_HISTORY_LIMIT and not st.checkbox("Show all", key="chat_history_show_all"):
+            chats = chats[:SIDEBAR_HISTORY_LIMIT]
+        for chat in chats:
+            role_icon = "🧑" if chat["role"] == "user" else "🤖"
+            # Only show relevant parts for brevity in sidebar
+            display_message = chat["message"]
+            if "\n\n" in display_message: # Truncate code blocks for sidebar
+                display_message = display_message.split("\n\n")[0] + "..."
+            elif len(display_message) > 60:
+                display_message = display_message[:60] + "..."
+
+            st.markdown(f"{role_icon} **{chat['role'].capitalize()}** ({chat['timestamp']})")
+            st.caption(display_message)
+    else:
+        st.caption("No chat history yet.")
+    
+    if st.button("🗑 Clear Chat History", key="clear_chat_btn"):
+        st.session_state.chat_history = []
+        st.rerun() # Rerun to update sidebar
+
+@fragment
+def sidebar_stored_files():
+    """Export of everything this session stored; the zip is only built on request"""
+    files = st.session_state.stored_files
+    if not files:
+        return
+    st.markdown("---")
+    st.subheader("📦 Stored Files")
+    st.caption(f"{len(files)} files (uploads, OCR text, code)")
+    if st.button("Prepare export", key="prepare_export_btn"):
+        with metrics.timer("artifact_export"):
+            archive = store.export_zip([(f["filename"], f["ref"]) for f in files])
+        st.download_button("⬇ Download all (.zip)", data=archive, mime="application/zip",
+                           file_name=f"ocr_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip", key="export_zip_btn")
+
+with st.sidebar:
+    st.title("Settings & History")
+    
+    # OCR Settings
+    st.subheader("OCR Settings")
+    # Added more common languages, but ensure Tesseract has them installed.
+    # "auto" detects the language per image and loads only that traineddata.
+    languages = [AUTO_LANG, "eng", "fra", "deu", "spa", "chi_sim", "jpn", "kor"]
+    lang_choice = st.selectbox("Select OCR Language", languages, index=0)
+    
+    # Show current extracted code if available
+    sidebar_extracted_code()
+    
+    # Show current OCR text if available
+    if st.session_state.current_ocr_ref:
+        st.markdown("---")
+        st.subheader("Current OCR Text")
+        st.text_area("Extracted Text", value=current_ocr_text(), height=100, disabled=True)
+        if st.button("🗑 Clear Current OCR", key="clear_ocr_btn"):
+            st.session_state.current_ocr_ref = None
+            st.session_state.conversation_context = [] # Clear context if OCR is cleared
+            st.rerun() # Rerun to clear sidebar section
+    
+    st.markdown("---")
+    sidebar_ocr_history()
+    sidebar_stored_files()
+    
+    # Chatbot Settings
+    st.markdown("---")
+    st.subheader("Chatbot Settings")
+    # "auto" lets model_router pick the cheapest model that suits each request
+    st.selectbox("Model", [AUTO_MODEL] + MODEL_TIERS, index=0, key="model_choice")
+    st.checkbox("Escalate weak answers", value=False, key="escalate_answers",
+                help="In auto mode, retry an empty or unsure answer on the next bigger model")
+    context_mode = st.checkbox("Use OCR Context in Chat", value=True, 
+                               help="When enabled, the chatbot will consider the extracted OCR text in all responses")
+    speculative_mode = st.checkbox("⚡ Prefetch suggested answers", value=False,
+                                   help="Answer the analysis' suggested questions in the background while the model is idle")
+    if speculative_mode:
+        hit_rate = PREFETCHER.hit_rate()
+        st.caption(f"Prefetched answers used: {PREFETCHER.used}/{PREFETCHER.generated}"
+                   + (f" ({hit_rate:.0%})" if hit_rate is not None else ""))
+    else:
+        PREFETCHER.cancel_session(st.session_state.session_id)
+    # Clicking interrupts the running script; cancelling also closes the stream so Ollama stops decoding
+    if st.button("⏹ Stop generating", key="stop_generation"):
+        if GENERATIONS.cancel_session(st.session_state.session_id):
+            st.toast("Generation stopped")
+    
+    st.markdown("---")
+    sidebar_chat_history()
+    
+    st.markdown("---")
+    render_metrics_panel(metrics, st)
 
 # ------------------ Custom CSS ------------------
-st.markdown("""
-<style>
-h1 {text-align: center; margin-bottom: 20px;}
-.chat-container {max-height: 500px; overflow-y: auto; padding: 10px; border: 1px solid #ddd; border-radius: 10px; background-color: #f9f9f9; margin-bottom: 10px;}
-.chat-bubble-user {background-color: #DCF8C6; color: black; padding: 10px; border-radius: 12px; margin:5px 0; max-width: 80%; align-self: flex-end; font-family: sans-serif;}
-.chat-bubble-assistant {background-color: #ffffff; color: black; padding: 10px; border-radius: 12px; margin:5px 0; max-width: 80%; align-self: flex-start; font-family: sans-serif;}
-.chat-bubble-ocr {background-color: #E3F2FD; color: black; padding: 10px; border-radius: 12px; margin:5px 0; max-width: 90%; align-self: flex-start; border-left: 4px solid #2196F3; font-family: sans-serif;}
-.chat-bubble-analysis {background-color: #F3E5F5; color: black; padding: 10px; border-radius: 12px; margin:5px 0; max-width: 90%; align-self: flex-start; border-left: 4px solid #9C27B0; font-family: sans-serif;}
-.flex-column {display: flex; flex-direction: column;}
-.bottom-bar {display: flex; gap: 10px; margin-top: 10px;}
-
-/* File upload styling for the single widget approach */
-.stFileUploader label {
-    display: flex;
-    flex-direction: column;
-    align-items: center;
-    justify-content: center;
-    padding: 20px;
-    border: 2px dashed #ccc;
-    border-radius: 10px;
-    background-color: #f9f9f9;
-    transition: all 0.3s ease;
-    cursor: pointer;
-}
-.stFileUploader label:hover {
-    border-color: #007bff;
-    background-color: #f0f8ff;
-}
-.stFileUploader label > div:first-of-type { /* Styles the first div inside the label, usually the upload icon/text */
-    font-size: 24px; /* Adjusted icon size */
-    color: #666;
-    margin-bottom: 10px;
-}
-.stFileUploader label > div:nth-of-type(2) { /* Styles the second div, usually the text description */
-    color: #666;
-    font-weight: 500;
-}
-.stFileUploader label > div:nth-of-type(3) { /* Styles the third div, usually the file type/size help text */
-    font-size: 12px; 
-    color: #999; 
-    margin-top: 5px;
-}
-
-.file-info {
-    background-color: #e3f2fd;
-    border: 1px solid #2196f3;
-    border-radius: 8px;
-    padding: 10px;
-    margin: 10px 0;
-    display: flex;
-    align-items: center;
-    gap: 10px;
-}
-.code-storage {
-    background-color: #f3e5f5;
-    border: 1px solid #9c27b0;
-    border-radius: 8px;
-    padding: 10px;
-    margin: 5px 0;
-}
-
-.status-indicator {
-    position: fixed;
-    top: 10px;
-    right: 10px;
-    padding: 5px 10px;
-    border-radius: 15px;
-    font-size: 12px;
-    font-weight: bold;
-    z-index: 1000; /* Ensure it's above other elements */
-}
-.context-active {background-color: #4CAF50; color: white;}
-.context-inactive {background-color: #FF9800; color: white;}
-
-/* Styling for code blocks within chat */
-.stCodeBlock {
-    border-radius: 8px !important;
-    padding: 15px !important;
-    font-family: 'Consolas', 'Monaco', 'Andale Mono', 'Ubuntu Mono', monospace !important;
-}
-</style>
-""", unsafe_allow_html=True)
+inject_css("ocr1.css")
 
 # ------------------ Page Header ------------------
 st.markdown("<h1>📄 OCR + 💬 Chatbot</h1>", unsafe_allow_html=True)
 
 # Status indicator
-if st.session_state.current_ocr_text and context_mode:
+if st.session_state.current_ocr_ref and context_mode:
     st.markdown('<div class="status-indicator context-active">📄 OCR Context Active</div>', unsafe_allow_html=True)
-elif st.session_state.current_ocr_text:
+elif st.session_state.current_ocr_ref:
     st.markdown('<div class="status-indicator context-inactive">📄 OCR Text Available (Context Off)</div>', unsafe_allow_html=True)
 
 # ------------------ Chat display ------------------
@@ -349,6 +405,9 @@ with chat_container:
         
         # Basic markdown rendering for messages
         message_content = chat["message"]
+        if chat.get("ref"):
+            # Extracted text is stored once and loaded here rather than copied into the history
+            message_content += f"\n\n```{chat.get('language') or ''}\n{load_artifact(chat['ref'])}\n```"
         # Handle code blocks by explicitly using st.markdown with st.code if needed, or just render markdown
         # For simplicity, treating most as markdown here.
         st.markdown(f'<div class="{bubble_class}"><div>{message_content.replace(chr(10), "<br>")}</div></div>', unsafe_allow_html=True) # Replace newlines with <br> for HTML display
@@ -366,8 +425,12 @@ with col1:
         label_visibility="visible"
     )
 
-    if uploaded_file is not None and uploaded_file != st.session_state.uploaded_file:
-        st.session_state.uploaded_file = uploaded_file
+    file_id = (getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}") if uploaded_file else None
+    if uploaded_file is not None and file_id != st.session_state.uploaded_file_id:
+        st.session_state.uploaded_file_id = file_id
+        # Guesses about the previous upload are no longer useful
+        PREFETCHER.cancel_session(st.session_state.session_id)
+        st.session_state.suggested_questions = []
         
         # Show file info
         file_size = uploaded_file.size / 1024  # Convert to KB
@@ -381,14 +444,32 @@ with col1:
         </div>
         """, unsafe_allow_html=True)
         
-        img = Image.open(uploaded_file)
+        try:
+            # Decoded at the size that suits the text in the image, never above IMAGE_MAX_PIXELS
+            with metrics.timer("upload_decode", kind="image"):
+                img = prepare_ocr_image(uploaded_file.getvalue())
+        except ImageTooLargeError as e:
+            st.session_state.chat_history.append({
+                "role": "assistant",
+                "message": f"⚠️ {e}. Please upload a smaller image.",
+                "timestamp": datetime.now().strftime("%H:%M")
+            })
+            st.rerun()
         
         with st.spinner("🔍 Extracting text from image..."):
-            text = pytesseract.image_to_string(img, lang=lang_choice).strip()
+            # "auto" is detected once per document content, so uploading the same image again skips it
+            doc_key = document_key(uploaded_file.getvalue())
+            text = extract_text_from_image(img, lang=lang_choice, cache_key=doc_key)
+        if lang_choice == AUTO_LANG:
+            st.caption(f"🌐 Detected OCR language: {cached_language(doc_key)}")
 
         if text:
+            # Store the upload and its text once; history and context only reference them
+            stem = uploaded_file.name.rsplit(".", 1)[0]
+            image_ref = store_file(uploaded_file.name, uploaded_file.getvalue(), compress=False)
+            text_ref = store_file(f"{stem}_ocr.txt", text)
             # Update current OCR text for context
-            st.session_state.current_ocr_text = text
+            st.session_state.current_ocr_ref = text_ref
             
             # Detect if extracted text is code
             detected_language = detect_code_language(text)
@@ -408,7 +489,9 @@ with col1:
             # Save OCR text to history
             st.session_state.ocr_history.append({
                 "filename": uploaded_file.name,
-                "text": text,
+                "ref": text_ref,
+                "image_ref": image_ref,
+                "preview": text[:60] + ("..." if len(text) > 60 else ""),
                 "timestamp": datetime.now().strftime("%H:%M"),
                 "is_code": is_code,
                 "language": detected_language if is_code else None
@@ -419,44 +502,39 @@ with col1:
             st.session_state.chat_history.append({
                 "role": "system",
                 "type": "ocr",
-                "message": f"{message_prefix} from {uploaded_file.name}:**\n\n```{detected_language if is_code else ''}\n{text}\n```",
+                "message": f"{message_prefix} from {uploaded_file.name}:**",
+                "ref": text_ref,
+                "language": detected_language if is_code else None,
                 "timestamp": datetime.now().strftime("%H:%M")
             })
 
             # Get AI analysis of the extracted text/code
-            with st.spinner("🤖 Analyzing extracted content..."):
-                if is_code:
-                    analysis_prompt = f"""This appears to be {detected_language} code extracted from an image. Please provide:
-1. A brief explanation of what this code does
-2. Key functions or components
-3. Any notable patterns or potential improvements
-4. Possible questions someone might ask about this code
-
-CODE:
-{text}"""
-                else:
-                    analysis_prompt = f"""Please analyze this text that was extracted from an image using OCR:
-
-TEXT:
-{text}
-
-Please provide:
-1. A brief summary of what this text appears to be
-2. Key information or points mentioned  
-3. Any notable details or observations
-4. Potential questions someone might want to ask about this content"""
-                
-                analysis = get_ollama_response(analysis_prompt, use_context=False)
-
-            # Add analysis to chat history
-            analysis_icon = "⚙️" if is_code else "🔍"
-            analysis_title = "Code Analysis" if is_code else "Text Analysis"
-            st.session_state.chat_history.append({
-                "role": "assistant",
-                "type": "analysis",
-                "message": f"{analysis_icon} **{analysis_title}:**\n\n{analysis}",
-                "timestamp": datetime.now().strftime("%H:%M")
-            })
+            streamed = {}
+            context = analysis = None
+            try:
+                with st.spinner("🤖 Analyzing extracted content..."):
+                    # Long text is summarised in parallel sections first so the prompt fits the context window
+                    context, analysis = condense_for_analysis(text, "code" if is_code else "text")
+                    if context:
+                        analysis_prompt = ocr_analysis_prompt(context, detected_language)
+                        analysis = get_ollama_response(analysis_prompt, use_context=False, priority=PRIORITY_BACKGROUND,
+                                                       streamed=streamed)
+            finally:
+                # Add analysis to chat history (also when Stop or a question interrupts it, with the partial text)
+                if analysis is None:
+                    context, analysis = None, stopped_reply(streamed)
+                analysis_icon = "⚙️" if is_code else "🔍"
+                analysis_title = "Code Analysis" if is_code else "Text Analysis"
+                st.session_state.chat_history.append({
+                    "role": "assistant",
+                    "type": "analysis",
+                    "message": f"{analysis_icon} **{analysis_title}:**\n\n{analysis}",
+                    "timestamp": datetime.now().strftime("%H:%M")
+                })
+            if context:
+                st.session_state.suggested_questions = parse_suggested_questions(analysis)
+                if speculative_mode and st.session_state.suggested_questions:
+                    start_prefetch(st.session_state.suggested_questions, context_mode)
 
             # Add helpful prompt
             help_message = "💡 I've extracted and analyzed the code from your image. You can ask me to explain specific functions, suggest improvements, or help debug any issues!" if is_code else "💡 I've extracted and analyzed the text from your image. Feel free to ask me questions about the content, request clarifications, or discuss any aspect of the extracted information!"
@@ -483,21 +561,44 @@ with col2:
                                placeholder="Ask questions about the extracted text or chat normally...")
     st.session_state.user_input = user_input # Update session state with current input
 
-    if st.button("Send", key="send_btn") and user_input.strip() != "":
+    # While answers are being prefetched the suggestions refresh themselves to show which are ready
+    (polling_fragment(2) if speculative_mode else fragment)(render_suggested_questions)(speculative_mode)
+
+    send_clicked = st.button("Send", key="send_btn") and user_input.strip() != ""
+    question = st.session_state.pop("queued_question", None) or (user_input if send_clicked else None)
+    if question:
         # Add user message to chat history
         st.session_state.chat_history.append({
             "role": "user",
-            "message": user_input,
+            "message": question,
             "timestamp": datetime.now().strftime("%H:%M")
         })
-        st.session_state.user_input = "" # Clear input box after sending
-
-        # Get AI response with or without OCR context
-        with st.spinner("Thinking..."):
-            if context_mode and st.session_state.current_ocr_text:
-                reply = get_ollama_response(user_input, use_context=True)
-            else:
-                reply = get_ollama_response(user_input, use_context=False)
+        if send_clicked:
+            st.session_state.user_input = "" # Clear input box after sending
+        st.session_state.suggested_questions = [q for q in st.session_state.suggested_questions if q != question]
+
+        # A prefetched answer is shown at once; anything else is a real request, so speculative work yields the model
+        reply = PREFETCHER.take(st.session_state.session_id, question)
+        if reply is not None:
+            reply = re.sub(r"<.*?>", "", reply)
+        else:
+            PREFETCHER.pause(st.session_state.session_id)
+            streamed = {}
+            try:
+                # Get AI response with or without OCR context
+                with st.spinner("Thinking..."):
+                    use_context = bool(context_mode and st.session_state.current_ocr_ref)
+                    reply = get_ollama_response(question, use_context=use_context, streamed=streamed)
+            finally:
+                if reply is None:
+                    # Stop or a newer message ended this run mid-answer: keep what had streamed so far
+                    st.session_state.chat_history.append({
+                        "role": "assistant",
+                        "message": stopped_reply(streamed),
+                        "timestamp": datetime.now().strftime("%H:%M")
+                    })
+                if speculative_mode:
+                    PREFETCHER.resume(st.session_state.session_id)
 
         # Add assistant reply to chat history
         st.session_state.chat_history.append({
@@ -528,4 +629,6 @@ with st.expander("ℹ️ How to use this app"):
     * Use clear, high-contrast images for better OCR accuracy.
     * Toggle "Use OCR Context" in the sidebar to control whether the AI bases its answers on the last OCR'd text.
     * Clear history or extracted code from the sidebar when needed.
-    """)
\ No newline at end of file
+    """)
+
+finish_run_timer(run_started, app="ocr1")
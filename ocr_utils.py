@@ -0,0 +1,479 @@
+import hashlib
+import importlib
+import io
+import math
+import os
+import re
+import threading
+import warnings
+from collections import OrderedDict
+from perf_metrics import get_metrics
+
+# Text extraction and code detection shared by ocr1.py, pdf.py and the benchmarks.
+# Nothing in here touches Streamlit, so it can be imported and timed on its own.
+#
+# PIL, pytesseract and PyMuPDF are only imported the first time they are needed,
+# so starting an app (or rerunning it without an upload) doesn't pay for them.
+
+metrics = get_metrics()
+
+# Tesseract path (Windows default install); override with TESSERACT_CMD.
+# If Tesseract is on your PATH and this file doesn't exist, PATH is used.
+TESSERACT_CMD = os.environ.get("TESSERACT_CMD", r"C:\Program Files\Tesseract-OCR\tesseract.exe")
+
+# Pass as `lang` to pick the OCR language per document instead of by hand
+AUTO_LANG = "auto"
+# Fallback when detection can't decide (and the language detection itself OCRs with)
+DEFAULT_LANG = "eng"
+# Side of the full-resolution square that language detection reads (the whole image if smaller)
+DETECT_SAMPLE_SIZE = 1000
+
+# Largest image (in pixels) ever held decoded; bigger uploads are decoded reduced or downscaled
+IMAGE_MAX_PIXELS = int(os.environ.get("IMAGE_MAX_PIXELS", "40000000"))
+# Images claiming more than this are refused before decoding (decompression bombs).
+# JPEGs can be decoded at 1/8 scale, so they may be up to 64x the working limit.
+IMAGE_REJECT_PIXELS = 64 * IMAGE_MAX_PIXELS
+# Longest side of the cached preview sent to the browser
+PREVIEW_MAX_SIDE = 1280
+PREVIEW_CACHE_SIZE = 64
+# Tesseract reads best when a line of ink is roughly OCR_LINE_HEIGHT pixels tall. Only
+# images whose lines fall outside the MIN..MAX band are rescaled, so ordinary screenshots
+# (ink is about 3/4 of the font size) are read as they are.
+OCR_LINE_HEIGHT = 30
+OCR_MIN_LINE_HEIGHT = 13
+OCR_MAX_LINE_HEIGHT = 48
+OCR_MAX_UPSCALE = 2.0
+# Small text is never enlarged beyond this many pixels (Tesseract time grows with the area)
+OCR_MAX_PIXELS = int(os.environ.get("OCR_MAX_PIXELS", "12000000"))
+
+_modules = {}
+_modules_lock = threading.Lock()
+
+# Encoded previews by content hash, most recent last
+_preview_cache = OrderedDict()
+_preview_cache_lock = threading.Lock()
+
+# Detected language per document (upload id or content hash), most recent last
+_lang_cache = OrderedDict()
+_lang_cache_lock = threading.Lock()
+LANG_CACHE_SIZE = 256
+_installed_langs = None
+
+
+def lazy_import(name):
+    """Import a heavy module on first use and keep it for the life of the process"""
+    module = _modules.get(name)
+    if module is None:
+        with _modules_lock:
+            module = _modules.get(name)
+            if module is None:
+                with metrics.timer("lazy_import", module=name):
+                    module = importlib.import_module(name)
+                if name == "pytesseract" and os.path.exists(TESSERACT_CMD):
+                    module.pytesseract.tesseract_cmd = TESSERACT_CMD
+                if name == "PIL.Image":
+                    # PIL refuses images over twice this at open time; below that decode_image decides
+                    module.MAX_IMAGE_PIXELS = IMAGE_REJECT_PIXELS // 2
+                    warnings.simplefilter("ignore", module.DecompressionBombWarning)
+                _modules[name] = module
+    return module
+
+
+def open_image(source):
+    """Open an image from a path, bytes or file-like object (e.g. a Streamlit upload)"""
+    Image = lazy_import("PIL.Image")
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+
+def document_key(data):
+    """Content hash used to cache per-document results"""
+    return hashlib.sha1(data).hexdigest()
+
+
+# ------------------ Image ingestion ------------------
+class ImageTooLargeError(ValueError):
+    """Raised for images too large to decode safely"""
+
+
+def decode_image(source, target_size=None, max_pixels=IMAGE_MAX_PIXELS):
+    """Decode an image no larger than needed.
+
+    `target_size` (width, height) is the size the caller wants; JPEGs are
+    decoded directly at the nearest reduced scale (draft mode) and then
+    resized. Whatever is asked for, the result never exceeds `max_pixels`.
+    Returns (image, original_size).
+    """
+    Image = lazy_import("PIL.Image")
+    try:
+        image = open_image(source)  # reads the header only
+    except Image.DecompressionBombError as e:
+        metrics.incr("image_rejected")
+        raise ImageTooLargeError(str(e)) from e
+    original_size = image.size
+    width, height = original_size
+    if target_size is None:
+        target_size = original_size
+    scale = min(1.0, math.sqrt(max_pixels / (width * height)))
+    target_size = (min(target_size[0], int(width * scale)) or 1, min(target_size[1], int(height * scale)) or 1)
+
+    if target_size[0] * target_size[1] < width * height:
+        if image.format == "JPEG":
+            image.draft(image.mode, target_size)
+        elif width * height > 2 * max_pixels:
+            # Only JPEG can skip pixels while decoding; anything else would be decoded whole
+            metrics.incr("image_rejected")
+            raise ImageTooLargeError(f"Image is {width}x{height} pixels; the limit is {max_pixels:,} pixels")
+    with metrics.timer("image_decode", format=image.format or "unknown"):
+        image.load()
+    if image.size[0] > target_size[0] or image.size[1] > target_size[1]:
+        image = image.resize(target_size, Image.LANCZOS, reducing_gap=3.0)
+        if original_size[0] * original_size[1] > max_pixels:
+            metrics.incr("image_downscaled")
+    return image, original_size
+
+
+def _fit(size, max_side):
+    width, height = size
+    scale = min(1.0, max_side / max(width, height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def preview_image(data, max_side=PREVIEW_MAX_SIDE):
+    """Small JPEG/PNG of an upload for display (cached by content hash)"""
+    key = (document_key(data), max_side)
+    with _preview_cache_lock:
+        preview = _preview_cache.get(key)
+        if preview is not None:
+            _preview_cache.move_to_end(key)
+            return preview
+    with metrics.timer("image_preview"):
+        header = open_image(data)
+        image, _ = decode_image(data, _fit(header.size, max_side))
+        buffer = io.BytesIO()
+        if image.mode in ("RGBA", "LA", "P"):
+            image.save(buffer, format="PNG", optimize=True)
+        else:
+            image.convert("RGB").save(buffer, format="JPEG", quality=85)
+        preview = buffer.getvalue()
+    with _preview_cache_lock:
+        _preview_cache[key] = preview
+        while len(_preview_cache) > PREVIEW_CACHE_SIZE:
+            _preview_cache.popitem(last=False)
+    return preview
+
+
+def estimate_line_height(image):
+    """Typical height in pixels of the text lines in an image, or None if no lines are found.
+
+    Averages each row to one pixel and measures the runs of rows that contain ink.
+    """
+    Image = lazy_import("PIL.Image")
+    gray = image.convert("L")
+    mean = gray.resize((1, 1), Image.BOX).getpixel((0, 0))
+    # Ink is whatever is darker (light themes) or lighter (dark themes) than the page
+    ink = gray.point(lambda p: 255 if (p < mean - 40 if mean >= 128 else p > mean + 40) else 0)
+    rows = list(ink.resize((1, ink.size[1]), Image.BOX).getdata())
+    runs = []
+    run = 0
+    for value in rows:
+        if value > 4:  # a row with at least ~2% ink
+            run += 1
+        elif run:
+            runs.append(run)
+            run = 0
+    if run:
+        runs.append(run)
+    runs = [r for r in runs if r >= 3]
+    if len(runs) < 2:
+        return None
+    runs.sort()
+    return runs[len(runs) // 2]
+
+
+def _ocr_scale(line_height, original_size):
+    """Resize factor for an image whose text lines are `line_height` original pixels tall"""
+    if not line_height or OCR_MIN_LINE_HEIGHT <= line_height <= OCR_MAX_LINE_HEIGHT:
+        return 1.0
+    scale = max(OCR_LINE_HEIGHT / line_height, 0.1)
+    if scale > 1.0:
+        budget = math.sqrt(OCR_MAX_PIXELS / (original_size[0] * original_size[1]))
+        scale = max(1.0, min(scale, OCR_MAX_UPSCALE, budget))
+    return scale
+
+
+def prepare_ocr_image(data):
+    """Decode an upload for OCR, rescaled only if its text is unusually small or large.
+
+    JPEGs are sampled at a reduced scale and then decoded directly at the
+    target size. Other formats can't be decoded reduced, so they are decoded
+    once and the line height is measured on a full-resolution crop of that.
+    """
+    Image = lazy_import("PIL.Image")
+    with metrics.timer("ocr_image_prepare"):
+        header = open_image(data)
+        original_size = header.size
+        if header.format == "JPEG":
+            image = None
+            sample, _ = decode_image(data, _fit(original_size, DETECT_SAMPLE_SIZE))
+            sample_height = sample.size[1]
+        else:
+            image, _ = decode_image(data)
+            sample, _ = _detection_sample(image)
+            sample_height = image.size[1]  # the crop keeps the decoded image's resolution
+        line_height = estimate_line_height(sample)
+        if line_height:
+            line_height = line_height * original_size[1] / sample_height
+        scale = _ocr_scale(line_height, original_size)
+        if scale != 1.0:
+            metrics.incr("ocr_image_rescaled", direction="down" if scale < 1 else "up")
+        target = (max(1, int(original_size[0] * scale)), max(1, int(original_size[1] * scale)))
+        if image is None:
+            image, _ = decode_image(data, target)
+        elif scale < 1.0 and (image.size[0] > target[0] or image.size[1] > target[1]):
+            image = image.resize(target, Image.LANCZOS, reducing_gap=3.0)
+        if scale > 1.0:
+            image = image.resize(target, Image.LANCZOS)
+    return image
+
+
+# ------------------ OCR language detection ------------------
+# Tesseract's OSD names a script; map it to the one traineddata file that covers it
+OSD_SCRIPT_LANGS = {
+    "Latin": "eng",
+    "Han": "chi_sim",
+    "HanS": "chi_sim",
+    "HanT": "chi_tra",
+    "Japanese": "jpn",
+    "Katakana": "jpn",
+    "Hiragana": "jpn",
+    "Hangul": "kor",
+    "Korean": "kor",
+    "Cyrillic": "rus",
+    "Arabic": "ara",
+    "Greek": "ell",
+    "Hebrew": "heb",
+    "Devanagari": "hin",
+    "Thai": "tha",
+}
+
+# Unicode ranges for telling scripts apart in text we already have
+SCRIPT_RANGES = [
+    ("jpn", re.compile(r"[\u3040-\u30ff]")),  # kana, checked before Han
+    ("kor", re.compile(r"[\uac00-\ud7af\u1100-\u11ff]")),
+    ("chi_sim", re.compile(r"[\u4e00-\u9fff]")),
+    ("rus", re.compile(r"[\u0400-\u04ff]")),
+    ("ara", re.compile(r"[\u0600-\u06ff]")),
+    ("ell", re.compile(r"[\u0370-\u03ff]")),
+]
+
+# Frequent short words for the Latin-script languages the apps offer
+LATIN_STOPWORDS = {
+    "eng": {"the", "and", "of", "to", "is", "in", "that", "for", "it", "with", "as", "on", "this", "are", "be"},
+    "fra": {"le", "les", "des", "est", "et", "une", "du", "que", "pour", "dans", "qui", "pas", "avec", "sur", "au"},
+    "deu": {"der", "die", "das", "und", "ist", "nicht", "ein", "eine", "zu", "mit", "den", "von", "sich", "auf", "für"},
+    "spa": {"el", "los", "las", "y", "en", "es", "por", "con", "para", "una", "del", "se", "que", "al", "lo"},
+}
+
+
+def text_language(text):
+    """Guess the Tesseract language of some text from its script and common words; None if unsure"""
+    sample = text[:5000]
+    for lang, pattern in SCRIPT_RANGES:
+        if len(pattern.findall(sample)) >= 5:
+            return lang
+    words = re.findall(r"[^\W\d_]+", sample.lower())
+    if not words:
+        return None
+    scores = {lang: sum(1 for w in words if w in stopwords) for lang, stopwords in LATIN_STOPWORDS.items()}
+    best = max(scores, key=scores.get)
+    # Code and short snippets barely use stopwords; stay on English unless another language clearly wins
+    if best != DEFAULT_LANG and scores[best] >= 3 and scores[best] > 1.5 * scores[DEFAULT_LANG]:
+        return best
+    return DEFAULT_LANG if scores[DEFAULT_LANG] else None
+
+
+def installed_languages():
+    """Traineddata files Tesseract can load (empty set if it can't be asked)"""
+    global _installed_langs
+    if _installed_langs is None:
+        try:
+            _installed_langs = set(lazy_import("pytesseract").get_languages(config=""))
+        except Exception:
+            _installed_langs = set()
+    return _installed_langs
+
+
+def _detection_sample(image):
+    """Greyscale region for detection, and whether it is the whole image.
+
+    Larger images give a DETECT_SAMPLE_SIZE square from the middle, cropped
+    rather than shrunk, so the text stays as legible as in the OCR pass.
+    """
+    width, height = image.size
+    if width <= DETECT_SAMPLE_SIZE and height <= DETECT_SAMPLE_SIZE:
+        return image.convert("L"), True
+    left = max(0, (width - DETECT_SAMPLE_SIZE) // 2)
+    top = max(0, (height - DETECT_SAMPLE_SIZE) // 2)
+    box = (left, top, min(width, left + DETECT_SAMPLE_SIZE), min(height, top + DETECT_SAMPLE_SIZE))
+    return image.crop(box).convert("L"), False
+
+
+def _detect_language(image):
+    """Pick the single Tesseract language for an image.
+
+    OSD names the script. For Latin script, a quick English pass is scored by
+    common words to tell eng/fra/deu/spa apart. Both read the whole image when
+    it is small, otherwise a full-resolution crop from the middle. Languages
+    that aren't installed fall back to eng. Returns the language, plus the
+    English pass' text when that pass read the whole image (else None).
+    """
+    pytesseract = lazy_import("pytesseract")
+    text = None
+    with metrics.timer("ocr_lang_detect"):
+        sample, whole = _detection_sample(image)
+        lang = None
+        try:
+            osd = pytesseract.image_to_osd(sample, config="--psm 0")
+            match = re.search(r"Script:\s*(\w+)", osd)
+            lang = OSD_SCRIPT_LANGS.get(match.group(1)) if match else None
+        except Exception:
+            pass  # no osd.traineddata, or too little text for OSD
+        if lang in (None, DEFAULT_LANG):
+            try:
+                english = pytesseract.image_to_string(sample, lang=DEFAULT_LANG)
+                lang = text_language(english) or DEFAULT_LANG
+                if whole:
+                    text = english.strip()
+            except Exception:
+                lang = DEFAULT_LANG
+    installed = installed_languages()
+    if installed and lang not in installed:
+        metrics.incr("ocr_lang_not_installed", lang=lang)
+        lang = DEFAULT_LANG
+    metrics.incr("ocr_lang_detected", lang=lang)
+    return lang, text
+
+
+def cached_language(cache_key):
+    with _lang_cache_lock:
+        lang = _lang_cache.get(cache_key)
+        if lang is not None:
+            _lang_cache.move_to_end(cache_key)
+        return lang
+
+
+def remember_language(cache_key, lang):
+    with _lang_cache_lock:
+        _lang_cache[cache_key] = lang
+        _lang_cache.move_to_end(cache_key)
+        while len(_lang_cache) > LANG_CACHE_SIZE:
+            _lang_cache.popitem(last=False)
+
+
+def _resolve(image, lang, cache_key):
+    """`lang`, or the detected language if it is "auto" (cached under cache_key), and
+    the English text detection already read, or None"""
+    if lang != AUTO_LANG:
+        return lang, None
+    if cache_key is not None:
+        cached = cached_language(cache_key)
+        if cached:
+            metrics.incr("ocr_lang_cache_hit")
+            return cached, None
+    detected, text = _detect_language(image)
+    if cache_key is not None:
+        remember_language(cache_key, detected)
+    return detected, text
+
+
+def extract_text_from_image(image, lang=None, cache_key=None):
+    """Extract text from PIL Image.
+
+    With lang="auto" the language is detected; pass document_key(data) as
+    cache_key so the same document is only detected once.
+    """
+    pytesseract = lazy_import("pytesseract")
+    lang, text = _resolve(image, lang, cache_key)
+    if text is not None and lang == DEFAULT_LANG:
+        # Detection already read the whole image in English; a second pass would give the same text
+        metrics.incr("ocr_lang_detect_text_reused")
+        return text
+    with metrics.timer("ocr_image_to_string", lang=lang or "default"):
+        if lang:
+            return pytesseract.image_to_string(image, lang=lang).strip()
+        return pytesseract.image_to_string(image).strip()
+
+
+def extract_text_from_pdf(pdf_file, lang=None):
+    """Extract the text of a PDF: its text layer plus OCR of the embedded images.
+
+    Images are OCRed one at a time and released straight away, so a scanned
+    PDF never holds more than one page image in memory.
+    """
+    fitz = lazy_import("fitz")  # PyMuPDF for PDF extraction
+    with metrics.timer("upload_decode", kind="pdf"):
+        pdf_bytes = pdf_file.read()
+        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+    metrics.incr("pdf_pages", pdf_document.page_count)
+    all_text = []
+    # "auto" is decided once per document: from the text layer if there is one
+    # (free), otherwise by detecting on the first embedded image
+    doc_key = document_key(pdf_bytes) if lang == AUTO_LANG else None
+    
+    for page_num in range(pdf_document.page_count):
+        page = pdf_document[page_num]
+        with metrics.timer("pdf_text_extract"):
+            text = page.get_text()
+        if text.strip():
+            all_text.append(f"--- Page {page_num + 1} ---\n{text}")
+            if doc_key and not cached_language(doc_key):
+                detected = text_language(text)
+                if detected and (not installed_languages() or detected in installed_languages()):
+                    remember_language(doc_key, detected)
+        image_list = page.get_images()
+        for img_index, img in enumerate(image_list):
+            xref = img[0]
+            image_bytes = pdf_document.extract_image(xref)["image"]
+            try:
+                image = prepare_ocr_image(image_bytes)
+            except ImageTooLargeError:
+                continue
+            del image_bytes
+            try:
+                ocr_text = extract_text_from_image(image, lang, cache_key=doc_key)
+            finally:
+                image.close()
+            if ocr_text:
+                all_text.append(f"--- Page {page_num + 1} (Image {img_index + 1}) ---\n{ocr_text}")
+    
+    pdf_document.close()
+    return "\n\n".join(all_text)
+
+
+def detect_code_language(text):
+    """Detect programming language from extracted text"""
+    text_lower = text.lower()
+    
+    # Python keywords and patterns
+    python_patterns = ['def ', 'import ', 'from ', 'class ', 'if __name__', 'print(', '.py', 'import numpy', 'import pandas', 'from sklearn']
+    # JavaScript patterns  
+    js_patterns = ['function ', 'var ', 'let ', 'const ', 'console.log', '.js', 'import ', 'export ']
+    # Java patterns
+    java_patterns = ['public class', 'public static void main', 'System.out.', '.java', 'import java.']
+    # C++ patterns
+    cpp_patterns = ['#include', 'using namespace', 'cout <<', '.cpp', '.h', 'std::cout']
+    
+    # Assign higher scores to more specific patterns
+    scores = {
+        'python': sum(1 for pattern in python_patterns if pattern in text_lower) * 2,
+        'javascript': sum(1 for pattern in js_patterns if pattern in text_lower) * 1.5,
+        'java': sum(1 for pattern in java_patterns if pattern in text_lower) * 1.8,
+        'cpp': sum(1 for pattern in cpp_patterns if pattern in text_lower) * 1.7
+    }
+    
+    detected_lang = max(scores, key=scores.get)
+    
+    # Only return a language if the score is significant enough to avoid false positives
+    return detected_lang if scores[detected_lang] > 1 else 'unknown'
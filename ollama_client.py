@@ -0,0 +1,271 @@
+import json
+import os
+import queue
+import threading
+import time
+
+# ------------------ Config ------------------
+# Point the apps (or the load-test driver) at another server, e.g. the mock in loadtest/
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434").rstrip("/")
+DEFAULT_MODEL = "llama3.2:1b"
+# (connect, read) seconds; read is the gap allowed between streamed chunks
+DEFAULT_TIMEOUT = (5, 300)
+# Hard deadline for one whole generation; past it the stream is closed
+GENERATION_TIMEOUT = float(os.environ.get("OLLAMA_GENERATION_TIMEOUT", "180"))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class OllamaUnavailableError(Exception):
+    """Raised when the Ollama server cannot be reached"""
+
+
+class OllamaHTTPError(Exception):
+    """Raised when Ollama answers with a non-200 status"""
+
+    def __init__(self, status_code, text):
+        super().__init__(f"Error {status_code}: {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+class GenerationCancelled(Exception):
+    """Raised when a generation is stopped, superseded or runs past its deadline"""
+
+    def __init__(self, reason, partial_text=""):
+        super().__init__(reason)
+        self.reason = reason
+        self.partial_text = partial_text
+
+
+def get_session():
+    """Process-wide HTTP session so every request reuses pooled keep-alive connections"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests  # imported on first request, not on every app start
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def _post(path, payload, stream, timeout):
+    import requests
+    try:
+        return get_session().post(f"{OLLAMA_URL}{path}", json=payload, stream=stream, timeout=timeout)
+    except requests.exceptions.ConnectionError as e:
+        raise OllamaUnavailableError(f"Could not connect to Ollama at {OLLAMA_URL}") from e
+
+
+def chat_request(model, messages, stream=False, timeout=DEFAULT_TIMEOUT):
+    """POST /api/chat and return the raw response"""
+    return _post("/api/chat", {"model": model, "messages": messages, "stream": stream}, stream, timeout)
+
+
+def generate_request(model, prompt, stream=False, timeout=DEFAULT_TIMEOUT):
+    """POST /api/generate and return the raw response"""
+    return _post("/api/generate", {"model": model, "prompt": prompt, "stream": stream}, stream, timeout)
+
+
+def iter_chunks(response):
+    """Yield each NDJSON object of a streaming response"""
+    for line in response.iter_lines():
+        if line:
+            yield json.loads(line)
+
+
+def chunk_text(chunk):
+    """Token text of a streamed chunk from either /api/generate or /api/chat"""
+    if "response" in chunk:
+        return chunk["response"]
+    return chunk.get("message", {}).get("content", "")
+
+
+def consume_stream(response, on_token=None, cancel=None):
+    """Read a streaming response to the end.
+
+    Calls on_token(token, text_so_far) for every token and returns a dict with
+    the full text, the final chunk (which carries Ollama's timing fields) and
+    perf_counter timestamps for the first and last token. If `cancel` (a
+    CancelToken) fires, the connection is closed and GenerationCancelled is
+    raised with the text received so far.
+    """
+    text = ""
+    final = {}
+    first_token_at = None
+    finished = False
+    if cancel:
+        cancel.attach(response)
+    try:
+        for chunk in iter_chunks(response):
+            if cancel:
+                cancel.check(text)
+            token = chunk_text(chunk)
+            if token:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                text += token
+                if on_token:
+                    on_token(token, text)
+            if chunk.get("error"):
+                raise RuntimeError(chunk["error"])
+            if chunk.get("done"):
+                final = chunk
+                break
+        finished = True
+    except Exception as e:
+        if cancel and cancel.cancelled:
+            raise GenerationCancelled(cancel.reason, text) from e
+        raise
+    finally:
+        # Closing the socket is what makes Ollama stop decoding an abandoned answer
+        if not finished:
+            response.close()
+    return {"text": text, "final": final, "first_token_at": first_token_at, "finished_at": time.perf_counter()}
+
+
+# ------------------ Cancellation ------------------
+class CancelToken:
+    """Cancels one generation (possibly several streams) and closes its connections"""
+
+    def __init__(self, timeout=None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._responses = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def attach(self, response):
+        """Register a streaming response so cancel() can close it"""
+        with self._lock:
+            self._responses.append(response)
+            already_cancelled = self.cancelled
+        if already_cancelled:
+            response.close()
+
+    def cancel(self, reason="stopped"):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.reason = reason
+            self._event.set()
+            responses = list(self._responses)
+        for response in responses:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def poll(self):
+        """True once cancelled; cancels first if the deadline has passed"""
+        if self.deadline and not self.cancelled and time.monotonic() > self.deadline:
+            self.cancel("timed out")
+        return self.cancelled
+
+    def check(self, partial_text=""):
+        """Raise GenerationCancelled if cancelled or past the deadline"""
+        if self.poll():
+            raise GenerationCancelled(self.reason, partial_text)
+
+
+class GenerationRegistry:
+    """Tracks the running generations of each session so they can be stopped or superseded"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+
+    def begin(self, session_id, timeout=None, supersede=True):
+        """Start a generation; by default any older one from the same session is cancelled"""
+        token = CancelToken(timeout)
+        with self._lock:
+            previous = self._tokens.get(session_id, []) if supersede else []
+            self._tokens[session_id] = [t for t in self._tokens.get(session_id, []) if t not in previous] + [token]
+        for old in previous:
+            old.cancel("superseded")
+        return token
+
+    def finish(self, session_id, token):
+        with self._lock:
+            tokens = self._tokens.get(session_id, [])
+            if token in tokens:
+                tokens.remove(token)
+            if not tokens:
+                self._tokens.pop(session_id, None)
+
+    def cancel_session(self, session_id, reason="stopped"):
+        """Stop every running generation of a session; returns how many were cancelled"""
+        with self._lock:
+            tokens = self._tokens.pop(session_id, [])
+        for token in tokens:
+            token.cancel(reason)
+        return len(tokens)
+
+    def active_count(self, session_id=None):
+        with self._lock:
+            if session_id is not None:
+                return len(self._tokens.get(session_id, []))
+            return sum(len(t) for t in self._tokens.values())
+
+
+# Shared by every session of the app process
+GENERATIONS = GenerationRegistry()
+
+
+def stream_with_heartbeat(send, cancel, render, heartbeat_interval=0.25):
+    """Stream a response on a worker thread while the caller's thread stays responsive.
+
+    `send()` must return a streaming response. `render(text_so_far)` is called
+    on the calling thread for every token and at least every
+    `heartbeat_interval` seconds. In Streamlit every UI update is a point where
+    a Stop click or a newer request can interrupt the script, so a run never
+    blocks inside a socket read. If anything interrupts this function, or
+    `cancel` fires, the connection is closed.
+    """
+    events = queue.Queue()
+
+    def worker():
+        try:
+            response = send()
+            if response.status_code != 200:
+                events.put(("http_error", OllamaHTTPError(response.status_code, response.text)))
+                return
+            result = consume_stream(response, lambda _, text: events.put(("token", text)), cancel)
+            events.put(("done", result))
+        except BaseException as e:
+            events.put(("error", e))
+
+    threading.Thread(target=worker, daemon=True).start()
+    text = ""
+    finished = False
+    try:
+        while True:
+            try:
+                kind, payload = events.get(timeout=heartbeat_interval)
+            except queue.Empty:
+                cancel.check(text)
+                render(text)
+                continue
+            if kind == "token":
+                text = payload
+                render(text)
+            elif kind == "done":
+                finished = True
+                return payload
+            else:
+                finished = True
+                if cancel.cancelled:
+                    raise GenerationCancelled(cancel.reason, text)
+                raise payload
+    finally:
+        if not finished:
+            cancel.cancel("stopped")
@@ -0,0 +1,252 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+# ------------------ Config ------------------
+# How many requests may hit Ollama at the same time, and how many may wait.
+MAX_CONCURRENT = int(os.environ.get("OLLAMA_MAX_CONCURRENT", "2"))
+MAX_QUEUE = int(os.environ.get("OLLAMA_MAX_QUEUE", "32"))
+MAX_QUEUED_PER_SESSION = int(os.environ.get("OLLAMA_MAX_QUEUED_PER_SESSION", "4"))
+
+# Lower number = served first. Chat the user is waiting on beats document analysis.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+# Guesses at what the user may ask next: only run while nothing else is running or
+# waiting, and are preempted (their on_preempt callback is called and the slot is
+# handed over) as soon as a real request would otherwise have to queue
+PRIORITY_SPECULATIVE = 2
+
+
+class QueueFullError(Exception):
+    """Raised when the scheduler cannot accept another request"""
+
+
+class Ticket:
+    """A single request's place in the scheduler queue"""
+
+    def __init__(self, scheduler, session_id, priority, on_preempt=None):
+        self.scheduler = scheduler
+        self.session_id = session_id
+        self.priority = priority
+        self.on_preempt = on_preempt
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self.released = False
+        self.preempted = False
+        self._granted = threading.Event()
+
+    def wait(self, timeout=None):
+        """Block until the request may run; returns False on timeout"""
+        return self._granted.wait(timeout)
+
+    @property
+    def granted(self):
+        return self._granted.is_set()
+
+    def position(self):
+        """1-based position in the queue, or 0 once running"""
+        return self.scheduler.position(self)
+
+    def estimated_wait(self):
+        """Estimated seconds until this request starts"""
+        return self.scheduler.estimated_wait(self)
+
+    def release(self):
+        """Give the slot back (or leave the queue if not yet started)"""
+        self.scheduler.release(self)
+
+    def __enter__(self):
+        self.wait()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class OllamaScheduler:
+    """Bounded, priority-aware, per-session fair queue in front of one Ollama server"""
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT, max_queue=MAX_QUEUE,
+                 max_queued_per_session=MAX_QUEUED_PER_SESSION):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queued_per_session = max_queued_per_session
+        self._lock = threading.Lock()
+        # priority -> OrderedDict(session_id -> deque of waiting tickets)
+        self._waiting = {}
+        self._active = set()
+        self._avg_service = 10.0  # seconds, updated as requests finish
+
+    # ---- public API ----
+    def submit(self, session_id, priority=PRIORITY_INTERACTIVE, on_preempt=None):
+        """Queue a request; raises QueueFullError if there is no room.
+
+        Speculative requests should pass `on_preempt`, a callable that stops the
+        request; it is called (without the lock held) when the slot is taken back.
+        """
+        with self._lock:
+            if self._waiting_count() >= self.max_queue:
+                raise QueueFullError("The model server is busy. Please try again in a moment.")
+            sessions = self._waiting.setdefault(priority, OrderedDict())
+            pending = sessions.get(session_id)
+            if pending is not None and len(pending) >= self.max_queued_per_session:
+                raise QueueFullError("You already have several requests waiting. Please wait for them to finish.")
+            ticket = Ticket(self, session_id, priority, on_preempt)
+            sessions.setdefault(session_id, deque()).append(ticket)
+            preempted = self._dispatch()
+        self._notify_preempted(preempted)
+        return ticket
+
+    def release(self, ticket):
+        """Free a running slot or drop a waiting ticket"""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket in self._active:
+                self._active.discard(ticket)
+                duration = time.monotonic() - ticket.granted_at
+                self._avg_service = 0.8 * self._avg_service + 0.2 * duration
+            else:
+                self._remove_waiting(ticket)
+            preempted = self._dispatch()
+        self._notify_preempted(preempted)
+
+    def position(self, ticket):
+        with self._lock:
+            if ticket.granted:
+                return 0
+            order = self._dispatch_order()
+            return order.index(ticket) + 1 if ticket in order else 0
+
+    def estimated_wait(self, ticket):
+        position = self.position(ticket)
+        if position == 0:
+            return 0.0
+        return math.ceil(position / self.max_concurrent) * self._avg_service
+
+    def stats(self):
+        """Snapshot of queue depth and utilisation"""
+        with self._lock:
+            return {
+                "active": len(self._active),
+                "waiting": self._waiting_count(),
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "avg_service_seconds": self._avg_service,
+            }
+
+    # ---- internals (call with lock held) ----
+    def _waiting_count(self):
+        return sum(len(q) for sessions in self._waiting.values() for q in sessions.values())
+
+    def _dispatch(self):
+        """Grant free slots; returns the speculative tickets preempted to make room"""
+        preempted = []
+        while True:
+            if len(self._active) >= self.max_concurrent:
+                victim = self._preemption_victim()
+                if victim is None:
+                    break
+                self._active.discard(victim)
+                victim.released = True
+                victim.preempted = True
+                preempted.append(victim)
+            ticket = self._pop_next()
+            if ticket is None:
+                break
+            ticket.granted_at = time.monotonic()
+            self._active.add(ticket)
+            ticket._granted.set()
+        return preempted
+
+    def _preemption_victim(self):
+        # Only for a real request; the most recently started speculative ticket loses the least work
+        if not any(self._waiting.get(p) for p in self._waiting if p < PRIORITY_SPECULATIVE):
+            return None
+        speculative = [t for t in self._active if t.priority >= PRIORITY_SPECULATIVE]
+        return max(speculative, key=lambda t: t.granted_at, default=None)
+
+    def _pop_next(self):
+        # Highest priority first; within a priority, sessions take turns.
+        for priority in sorted(self._waiting):
+            sessions = self._waiting[priority]
+            if not sessions:
+                continue
+            if priority >= PRIORITY_SPECULATIVE and not self._idle_for_speculation():
+                return None
+            session_id, pending = next(iter(sessions.items()))
+            ticket = pending.popleft()
+            if pending:
+                sessions.move_to_end(session_id)
+            else:
+                del sessions[session_id]
+            return ticket
+        return None
+
+    def _idle_for_speculation(self):
+        if any(t.priority < PRIORITY_SPECULATIVE for t in self._active):
+            return False
+        # Keep a slot free for real requests when there is more than one; with a single
+        # slot, speculation may use it because preemption gives it back on demand
+        return len(self._active) < max(1, self.max_concurrent - 1)
+
+    @staticmethod
+    def _notify_preempted(tickets):
+        # Outside the lock: callbacks may close connections or take other locks
+        for ticket in tickets:
+            if ticket.on_preempt is not None:
+                ticket.on_preempt()
+
+    def _remove_waiting(self, ticket):
+        sessions = self._waiting.get(ticket.priority, {})
+        pending = sessions.get(ticket.session_id)
+        if pending and ticket in pending:
+            pending.remove(ticket)
+            if not pending:
+                del sessions[ticket.session_id]
+
+    def _dispatch_order(self):
+        order = []
+        for priority in sorted(self._waiting):
+            queues = [list(q) for q in self._waiting[priority].values()]
+            depth = max((len(q) for q in queues), default=0)
+            for i in range(depth):
+                order.extend(q[i] for q in queues if i < len(q))
+        return order
+
+
+def acquire_with_status(ticket, placeholder, poll_interval=0.5):
+    """Wait for a ticket, showing queue position and estimated wait in a Streamlit placeholder"""
+    try:
+        while not ticket.wait(poll_interval):
+            placeholder.info(
+                f"⏳ Waiting for the model server • position {ticket.position()} "
+                f"• est. wait ~{ticket.estimated_wait():.0f}s"
+            )
+        placeholder.empty()
+    except BaseException:
+        # Streamlit stops the script on rerun from inside any element call, even
+        # right after the grant; never leak a queued or granted ticket.
+        ticket.release()
+        raise
+    return ticket
+
+
+# ------------------ Process-wide instance ------------------
+# Streamlit runs every browser session of an app in one process, so a
+# module-level scheduler is shared by all of them.
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the shared scheduler for this process"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = OllamaScheduler()
+        return _scheduler
@@ -1,148 +1,178 @@
 import streamlit as st
-from PIL import Image
-import pytesseract
 from datetime import datetime
-import requests
-import fitz  # PyMuPDF for PDF extraction
-import io
+import time
+import uuid
+from app_core import inject_css, init_session_state, fragment, start_run_timer, finish_run_timer
+from perf_metrics import get_metrics, render_metrics_panel
+from ocr_utils import (extract_text_from_image, extract_text_from_pdf, preview_image, prepare_ocr_image,
+                       document_key, ImageTooLargeError, AUTO_LANG)
+from ollama_client import (generate_request, stream_with_heartbeat, GENERATIONS,
+                           GENERATION_TIMEOUT, GenerationCancelled, OllamaHTTPError)
+from summarizer import condense_text
+from prompts import pdf_prompt, PDF_ANALYSIS_QUESTION
+from model_router import get_router, AUTO_MODEL, MODEL_TIERS
+from ollama_scheduler import (get_scheduler, acquire_with_status, QueueFullError,
+                              PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND)
 
 # ============ CONFIG ============
+run_started = start_run_timer()
 st.set_page_config(page_title="Smart OCR Chat", layout="wide", page_icon="🤖")
 
-# Tesseract path (adjust if needed)
-try:
-    pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-except:
-    pass
+# Tesseract path is configured in ocr_utils (TESSERACT_CMD) the first time OCR runs
+
+metrics = get_metrics()
+
+# History entries shown in the sidebar before "Show all" is ticked
+SIDEBAR_HISTORY_LIMIT = 10
 
 # ============ SESSION STATE ============
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-if "extracted_text" not in st.session_state:
-    st.session_state.extracted_text = ""
+init_session_state({
+    "messages": list,
+    "extracted_text": "",
+    "processed_file_id": None,  # upload already extracted + analysed, so reruns skip it
+    "session_id": lambda: uuid.uuid4().hex,  # key for the shared request scheduler
+})
 
 # ============ STYLING ============
-st.markdown("""
-<style>
-    .main {padding: 1rem;}
-    .chat-message {padding: 1rem; border-radius: 10px; margin-bottom: 1rem; animation: fadeIn 0.3s;}
-    .user-message {background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; margin-left: 20%;}
-    .assistant-message {background: #f7f7f8; color: #1a1a1a; margin-right: 20%; border-left: 4px solid #667eea;}
-    .ocr-message {background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%); color: white; border-radius: 15px; padding: 1.5rem;}
-    @keyframes fadeIn {from {opacity: 0; transform: translateY(10px);} to {opacity: 1; transform: translateY(0);}}
-    .stSpinner > div {border-top-color: #667eea !important;}
-    .upload-text {text-align: center; color: #666; padding: 2rem; border: 2px dashed #ccc; border-radius: 10px; background: #fafafa; transition: all 0.3s;}
-    .upload-text:hover {border-color: #667eea; background: #f0f0ff;}
-    .sidebar .sidebar-content {background: linear-gradient(180deg, #667eea 0%, #764ba2 100%);}
-    .stCodeBlock {background: #1e1e1e !important; border-radius: 8px !important;}
-    .stTextInput > div > div > input {border-radius: 20px; border: 2px solid #e0e0e0; padding: 0.75rem 1rem;}
-    .stTextInput > div > div > input:focus {border-color: #667eea; box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.1);}
-</style>
-""", unsafe_allow_html=True)
+inject_css("pdf.css")
 
 # ============ HELPER FUNCTIONS ============
-def extract_text_from_image(image):
-    """Extract text from PIL Image"""
-    return pytesseract.image_to_string(image).strip()
-
-def extract_text_from_pdf(pdf_file):
-    """Extract text and images from PDF"""
-    pdf_bytes = pdf_file.read()
-    pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-    all_text = []
-    images = []
-    
-    for page_num in range(pdf_document.page_count):
-        page = pdf_document[page_num]
-        text = page.get_text()
-        if text.strip():
-            all_text.append(f"--- Page {page_num + 1} ---\n{text}")
-        image_list = page.get_images()
-        for img_index, img in enumerate(image_list):
-            xref = img[0]
-            base_image = pdf_document.extract_image(xref)
-            image_bytes = base_image["image"]
-            image = Image.open(io.BytesIO(image_bytes))
-            images.append(image)
-            ocr_text = extract_text_from_image(image)
-            if ocr_text:
-                all_text.append(f"--- Page {page_num + 1} (Image {img_index + 1}) ---\n{ocr_text}")
-    
-    pdf_document.close()
-    return "\n\n".join(all_text), images
-
-def stream_ollama_response(prompt, extracted_context=""):
-    """Stream response from Ollama in real-time"""
+def stream_ollama_response(prompt, extracted_context="", priority=PRIORITY_INTERACTIVE, streamed=None):
+    """Stream response from Ollama in real-time (the text so far is kept in streamed["text"] if given)"""
+    streamed = streamed if streamed is not None else {}
+    streamed["text"] = ""
+    router = get_router()
+    # "auto" in the sidebar lets the router pick the cheapest model that suits the request
+    decision = router.route(prompt, extracted_context, app="pdf", model=st.session_state.get("model_choice", AUTO_MODEL))
     try:
-        full_prompt = prompt
-        if extracted_context:
-            full_prompt = f"""Based on this extracted text:
-
-{extracted_context}
+        with metrics.timer("prompt_build"):
+            full_prompt = pdf_prompt(prompt, extracted_context)
+        
+        placeholder = st.empty()
 
-User question: {prompt}
+        def render(text):
+            streamed["text"] = text
+            placeholder.markdown((text or "⏳ Thinking...") + "▌")
 
-Please provide a helpful response."""
-        
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json={"model": "llama3.2:1b", "prompt": full_prompt, "stream": True},
-            stream=True
-        )
-        
-        if response.status_code == 200:
-            full_response = ""
-            placeholder = st.empty()
-            for line in response.iter_lines():
-                if line:
-                    import json
-                    chunk = json.loads(line)
-                    if "response" in chunk:
-                        full_response += chunk["response"]
-                        placeholder.markdown(full_response + "▌")
+        while True:
+            with metrics.timer("queue_wait"):
+                ticket = acquire_with_status(get_scheduler().submit(st.session_state.session_id, priority), placeholder)
+            with ticket:
+                start = time.perf_counter()
+                # A newer request from this session cancels this one (and vice versa)
+                cancel = GENERATIONS.begin(st.session_state.session_id, timeout=GENERATION_TIMEOUT)
+                try:
+                    result = stream_with_heartbeat(
+                        lambda: generate_request(decision.model, full_prompt, stream=True),
+                        cancel,
+                        render
+                    )
+                finally:
+                    GENERATIONS.finish(st.session_state.session_id, cancel)
+                full_response = result["text"]
+                metrics.record_ollama(result["final"], source="pdf")
+                metrics.record_stream(result, start, source="pdf")
+            router.record(decision, result=result)
+            # Optionally give a weak answer from a small model a second try one size up
+            if st.session_state.get("escalate_answers") and router.should_escalate(decision, full_response):
+                decision = router.escalate(decision)
+                continue
             placeholder.markdown(full_response)
             return full_response
-        else:
-            return "❌ Error: Cannot connect to Ollama. Make sure it's running!"
             
+    except QueueFullError as e:
+        return f"⏳ {str(e)}"
+    except GenerationCancelled as e:
+        router.record(decision, outcome="cancelled")
+        metrics.incr("generations_cancelled", reason=e.reason)
+        placeholder.markdown(e.partial_text)
+        return f"{e.partial_text}\n\n⏹ _Generation {e.reason}._"
+    except OllamaHTTPError:
+        router.record(decision, outcome="http_error")
+        return "❌ Error: Cannot connect to Ollama. Make sure it's running!"
     except Exception as e:
         return f"❌ Error: {str(e)}"
+    except BaseException:
+        # Stop or a newer request ended this script run mid-answer; the caller keeps the partial text
+        router.record(decision, outcome="cancelled")
+        metrics.incr("generations_cancelled", reason="stopped")
+        raise
+
+def stopped_reply(streamed):
+    """What is kept in the history when a run is interrupted mid-answer"""
+    return f"{streamed.get('text', '')}\n\n⏹ _Generation stopped._".strip()
+
+def condense_for_analysis(text):
+    """Map-reduce long text into section summaries; returns (context, error message)"""
+    progress = st.empty()
+    try:
+        context = condense_text(text, st.session_state.session_id,
+                                on_progress=lambda done, total: progress.caption(f"📚 Summarising long document: {done}/{total} sections"))
+        return context, None
+    except GenerationCancelled as e:
+        metrics.incr("generations_cancelled", reason=e.reason)
+        return None, f"⏹ _Generation {e.reason}._"
+    except Exception as e:
+        return None, f"❌ Error: {str(e)}"
+    finally:
+        progress.empty()
 
 # ============ SIDEBAR ============
-with st.sidebar:
-    st.markdown("### 🎯 Smart OCR Chat")
-    st.markdown("---")
-    
+@fragment
+def sidebar_history():
+    """Extracted text and chat history; "Show all" only reruns this fragment"""
     if st.session_state.extracted_text:
         st.markdown("### 📄 Extracted Content")
         with st.expander("View Text", expanded=False):
-            st.text_area("", value=st.session_state.extracted_text, height=200, disabled=True, key="sidebar_text")
+            st.text_area("Extracted text", value=st.session_state.extracted_text, height=200, disabled=True,
+                         key="sidebar_text", label_visibility="collapsed")
     
     # Show chat history in sidebar
     if st.session_state.messages:
         st.markdown("---")
         st.markdown("### 💬 Chat History")
         with st.expander("View History", expanded=False):
-            for i, chat in enumerate(st.session_state.messages):
+            messages = st.session_state.messages
+            if len(messages) > SIDEBAR_HISTORY_LIMIT and not st.checkbox("Show all", key="history_show_all"):
+                messages = messages[-SIDEBAR_HISTORY_LIMIT:]
+            for i, chat in enumerate(messages):
                 role_emoji = "👤" if chat["role"] == "user" else "🤖"
                 timestamp = chat.get("timestamp", "")
                 st.markdown(f"**{role_emoji} {chat['role'].title()}** _{timestamp}_")
                 st.markdown(f"{chat['content']}")
-                if i < len(st.session_state.messages) - 1:
+                if i < len(messages) - 1:
                     st.markdown("---")
         
         if st.button("🗑️ Clear", key="clear_text"):
             st.session_state.extracted_text = ""
             st.rerun()
+
+with st.sidebar:
+    st.markdown("### 🎯 Smart OCR Chat")
+    st.markdown("---")
+    
+    sidebar_history()
     
     st.markdown("---")
     st.markdown("### ⚙️ Settings")
-    ocr_lang = st.selectbox("OCR Language", ["eng", "fra", "deu", "spa", "chi_sim"], index=0)
+    # "auto" detects the script/language once per document and loads only that traineddata
+    ocr_lang = st.selectbox("OCR Language", [AUTO_LANG, "eng", "fra", "deu", "spa", "chi_sim"], index=0)
+    st.selectbox("Model", [AUTO_MODEL] + MODEL_TIERS, index=0, key="model_choice")
+    st.checkbox("Escalate weak answers", value=False, key="escalate_answers",
+                help="In auto mode, retry an empty or unsure answer on the next bigger model")
+    
+    render_metrics_panel(metrics, st)
     
     st.markdown("---")
+    # Clicking interrupts the running script; cancelling also closes the stream so Ollama stops decoding
+    if st.button("⏹ Stop generating", key="stop_generation"):
+        if GENERATIONS.cancel_session(st.session_state.session_id):
+            st.toast("Generation stopped")
+    
     if st.button("🗑️ Clear All Chat"):
         st.session_state.messages = []
         st.session_state.extracted_text = ""
+        st.session_state.processed_file_id = None
         st.rerun()
 
 # ============ MAIN INTERFACE ============
@@ -155,31 +185,61 @@ uploaded_file = st.file_uploader("📎 Drop your file here (Image or PDF)", type
 # Process uploaded file
 if uploaded_file:
     file_type = uploaded_file.type
-    with st.spinner("🔍 Extracting text..."):
-        if "pdf" in file_type:
-            text, images = extract_text_from_pdf(uploaded_file)
-            st.session_state.extracted_text = text
-            st.markdown(f'<div class="chat-message ocr-message">📄 <strong>PDF Processed!</strong><br>Extracted from: {uploaded_file.name}<br>Pages analyzed with OCR on embedded images</div>', unsafe_allow_html=True)
-        else:
-            image = Image.open(uploaded_file)
-            st.image(image, caption="Uploaded Image", use_column_width=True)
-            text = extract_text_from_image(image)
-            st.session_state.extracted_text = text
+    # The uploader keeps returning the same file on every rerun; only extract and analyse it once
+    file_id = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+    file_id = f"{file_id}:{ocr_lang}"  # a different OCR language means extracting again
+    is_new_upload = file_id != st.session_state.processed_file_id
+    if is_new_upload:
+        # Recorded before the work starts: if Stop or a question interrupts extraction or analysis,
+        # the next run must not start them all over again
+        st.session_state.processed_file_id = file_id
+    
+    if "pdf" in file_type:
+        if is_new_upload:
+            with st.spinner("🔍 Extracting text..."):
+                text = extract_text_from_pdf(uploaded_file, lang=ocr_lang)
+                st.session_state.extracted_text = text
+        st.markdown(f'<div class="chat-message ocr-message">📄 <strong>PDF Processed!</strong><br>Extracted from: {uploaded_file.name}<br>Pages analyzed with OCR on embedded images</div>', unsafe_allow_html=True)
+    else:
+        data = uploaded_file.getvalue()
+        try:
+            # The browser gets a cached, downscaled preview instead of a possibly huge original
+            st.image(preview_image(data), caption="Uploaded Image", use_column_width=True)
+            if is_new_upload:
+                with st.spinner("🔍 Extracting text..."):
+                    # OCR gets its own copy, decoded at the size that suits the text in the image
+                    with metrics.timer("upload_decode", kind="image"):
+                        image = prepare_ocr_image(data)
+                    # "auto" is detected once per document content, not once per upload
+                    text = extract_text_from_image(image, lang=ocr_lang, cache_key=document_key(data))
+                    st.session_state.extracted_text = text
             st.markdown(f'<div class="chat-message ocr-message">🖼️ <strong>Text Extracted!</strong><br>From: {uploaded_file.name}</div>', unsafe_allow_html=True)
+        except ImageTooLargeError as e:
+            st.error(f"⚠️ {e}")
+            st.session_state.extracted_text = ""
     
     if st.session_state.extracted_text:
         with st.expander("📝 View Extracted Text"):
             st.code(st.session_state.extracted_text, language="text")
         
-        st.markdown("### 🤖 AI Analysis")
-        with st.spinner("Analyzing..."):
-            analysis_prompt = "Analyze this text briefly. What is it about? Summarize key points in 3-4 sentences."
-            analysis = stream_ollama_response(analysis_prompt, st.session_state.extracted_text)
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": f"📊 **Analysis:** {analysis}",
-                "timestamp": datetime.now().strftime("%H:%M")
-            })
+        if is_new_upload:
+            st.markdown("### 🤖 AI Analysis")
+            with st.spinner("Analyzing..."):
+                # Long documents are summarised in parallel sections first so the prompt fits the context window
+                streamed = {}
+                analysis = None
+                try:
+                    context, analysis = condense_for_analysis(st.session_state.extracted_text)
+                    if context:
+                        analysis = stream_ollama_response(PDF_ANALYSIS_QUESTION, context, PRIORITY_BACKGROUND, streamed)
+                finally:
+                    if analysis is None:
+                        analysis = stopped_reply(streamed)
+                    st.session_state.messages.append({
+                        "role": "assistant",
+                        "content": f"📊 **Analysis:** {analysis}",
+                        "timestamp": datetime.now().strftime("%H:%M")
+                    })
     else:
         st.warning("⚠️ No text found in the file. Try a clearer image or different PDF.")
 
@@ -206,15 +266,20 @@ if user_input:
         st.write(user_input)
     
     # Generate and display assistant response
-    with st.chat_message("assistant"):
-        response = stream_ollama_response(user_input, st.session_state.extracted_text)
-    
-    # Add assistant message to history
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": response,
-        "timestamp": datetime.now().strftime("%H:%M")
-    })
+    streamed = {}
+    response = None
+    try:
+        with st.chat_message("assistant"):
+            response = stream_ollama_response(user_input, st.session_state.extracted_text, streamed=streamed)
+    finally:
+        # Also runs when Stop or a newer message interrupts the answer, so the partial text is kept
+        if response is None:
+            response = stopped_reply(streamed)
+        st.session_state.messages.append({
+            "role": "assistant",
+            "content": response,
+            "timestamp": datetime.now().strftime("%H:%M")
+        })
     
     st.rerun()
 
@@ -240,4 +305,6 @@ with st.expander("ℹ️ How to Use"):
     - Tesseract OCR installed
     - Ollama running locally (port 11434)
     - PyMuPDF: `pip install PyMuPDF`
-    """)
\ No newline at end of file
+    """)
+
+finish_run_timer(run_started, app="pdf")
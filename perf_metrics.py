@@ -0,0 +1,229 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ------------------ Config ------------------
+# JSONL trace of every timed stage; set METRICS_TRACE_PATH="" to turn it off.
+TRACE_PATH = os.environ.get("METRICS_TRACE_PATH", "metrics_trace.jsonl")
+# Past this size the trace is moved to <path>.1 (replacing the older one) and restarted
+TRACE_MAX_BYTES = int(os.environ.get("METRICS_TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+# If set, Prometheus text format is served on http://0.0.0.0:<port>/metrics
+METRICS_PORT = os.environ.get("METRICS_PORT", "")
+METRIC_PREFIX = "codegenie"
+RECENT_SAMPLES = 200
+
+# Ollama reports these in nanoseconds on the final response object
+OLLAMA_DURATION_FIELDS = ["total_duration", "load_duration", "prompt_eval_duration", "eval_duration"]
+OLLAMA_COUNT_FIELDS = ["prompt_eval_count", "eval_count"]
+
+
+class Metrics:
+    """Thread-safe stage timings and counters, exportable as Prometheus text or JSONL"""
+
+    def __init__(self, trace_path=TRACE_PATH, trace_max_bytes=TRACE_MAX_BYTES):
+        self.trace_path = trace_path
+        self.trace_max_bytes = trace_max_bytes
+        self._lock = threading.Lock()
+        # File writes have their own lock so recording and snapshots never wait on disk I/O
+        self._trace_lock = threading.Lock()
+        self._trace_size = None
+        self._stages = {}
+        self._counters = {}
+
+    # ---- recording ----
+    @contextmanager
+    def timer(self, stage, **labels):
+        """Time a block of code as one sample of `stage`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    def observe(self, stage, seconds, **labels):
+        """Record one duration sample (in seconds) for a stage"""
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = {"count": 0, "sum": 0.0, "max": 0.0, "recent": deque(maxlen=RECENT_SAMPLES)}
+                self._stages[stage] = entry
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            entry["recent"].append(seconds)
+        self._trace({"type": "timing", "stage": stage, "seconds": round(seconds, 6), **labels})
+
+    def incr(self, name, value=1, **labels):
+        """Increase a counter"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+        if labels:
+            self._trace({"type": "counter", "name": name, "value": value, **labels})
+
+    def record_ollama(self, data, source):
+        """Record the timing/count fields Ollama returns with a finished response"""
+        if not isinstance(data, dict):
+            return
+        fields = {}
+        for field in OLLAMA_DURATION_FIELDS:
+            if data.get(field):
+                self.observe(f"ollama_{field}", data[field] / 1e9, source=source)
+                fields[field] = data[field]
+        for field in OLLAMA_COUNT_FIELDS:
+            if data.get(field):
+                self.incr(f"ollama_{field}", data[field])
+                fields[field] = data[field]
+        if data.get("eval_count") and data.get("eval_duration"):
+            fields["tokens_per_sec"] = round(data["eval_count"] / (data["eval_duration"] / 1e9), 2)
+        if fields:
+            self._trace({"type": "ollama", "source": source, "model": data.get("model"), **fields})
+
+    def record_stream(self, result, started, **labels):
+        """Record `ttft` and `generation` for a consume_stream() result whose request was sent at `started`"""
+        if result["first_token_at"] is None:
+            return
+        self.observe("ttft", result["first_token_at"] - started, **labels)
+        self.observe("generation", result["finished_at"] - result["first_token_at"], **labels)
+
+    # ---- reading ----
+    def snapshot(self):
+        """Per-stage count/mean/p50/p95/max and counters"""
+        with self._lock:
+            stages = {}
+            for stage, entry in self._stages.items():
+                recent = sorted(entry["recent"])
+                stages[stage] = {
+                    "count": entry["count"],
+                    "mean": entry["sum"] / entry["count"],
+                    "p50": _percentile(recent, 0.50),
+                    "p95": _percentile(recent, 0.95),
+                    "max": entry["max"],
+                }
+            return {"stages": stages, "counters": dict(self._counters)}
+
+    def to_prometheus(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            lines = [
+                f"# HELP {METRIC_PREFIX}_stage_seconds Time spent per processing stage",
+                f"# TYPE {METRIC_PREFIX}_stage_seconds summary",
+            ]
+            for stage, entry in sorted(self._stages.items()):
+                recent = sorted(entry["recent"])
+                for q in (0.5, 0.95):
+                    lines.append(f'{METRIC_PREFIX}_stage_seconds{{stage="{stage}",quantile="{q}"}} {_percentile(recent, q):.6f}')
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {entry["sum"]:.6f}')
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} {entry["count"]}')
+            for name, value in sorted(self._counters.items()):
+                lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+                lines.append(f"{METRIC_PREFIX}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def read_trace(self):
+        """Return the JSONL trace, the rotated part first (empty if tracing is off)"""
+        if not self.trace_path:
+            return ""
+        parts = []
+        with self._trace_lock:
+            for path in (self.trace_path + ".1", self.trace_path):
+                if os.path.exists(path):
+                    with open(path, encoding="utf-8") as f:
+                        parts.append(f.read())
+        return "".join(parts)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+    # ---- internals ----
+    def _trace(self, event):
+        if not self.trace_path:
+            return
+        event = {"ts": round(time.time(), 3), **event}
+        line = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._trace_lock:
+            if self._trace_size is None:
+                self._trace_size = os.path.getsize(self.trace_path) if os.path.exists(self.trace_path) else 0
+            if self.trace_max_bytes and self._trace_size + len(line) > self.trace_max_bytes:
+                try:
+                    os.replace(self.trace_path, self.trace_path + ".1")
+                except OSError:
+                    pass
+                self._trace_size = 0
+            with open(self.trace_path, "ab") as f:
+                f.write(line)
+            self._trace_size += len(line)
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# ------------------ Streamlit panel ------------------
+def render_metrics_panel(metrics, container):
+    """Show a live metrics summary with export buttons in a Streamlit container (e.g. st.sidebar)"""
+    snapshot = metrics.snapshot()
+    panel = container.expander("📈 Performance Metrics", expanded=False)
+    if not snapshot["stages"]:
+        panel.caption("No measurements yet.")
+    for stage, s in sorted(snapshot["stages"].items()):
+        panel.caption(f"**{stage}** • n={s['count']} • p50 {s['p50'] * 1000:.0f} ms • p95 {s['p95'] * 1000:.0f} ms")
+    for name, value in sorted(snapshot["counters"].items()):
+        panel.caption(f"{name}: {value}")
+    panel.download_button("⬇ Prometheus metrics", metrics.to_prometheus(),
+                          file_name="metrics.prom", mime="text/plain", key="metrics_prom_download")
+    # The trace file can be megabytes, so it is only read when asked for
+    if metrics.trace_path and panel.button("Prepare JSONL trace", key="metrics_trace_prepare"):
+        panel.download_button("⬇ JSONL trace", metrics.read_trace(),
+                              file_name="metrics_trace.jsonl", mime="application/jsonl", key="metrics_trace_download")
+
+
+# ------------------ Prometheus endpoint ------------------
+def start_metrics_server(metrics, port):
+    """Serve /metrics for Prometheus scraping on a background thread"""
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", int(port)), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ------------------ Process-wide instance ------------------
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Return the shared metrics registry for this process"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+            if METRICS_PORT:
+                try:
+                    start_metrics_server(_metrics, METRICS_PORT)
+                except OSError:
+                    pass  # another app on this machine already serves the port
+        return _metrics
@@ -0,0 +1,190 @@
+import re
+import threading
+from ollama_client import consume_stream, GENERATIONS, GENERATION_TIMEOUT, GenerationCancelled
+from ollama_scheduler import get_scheduler, QueueFullError, PRIORITY_SPECULATIVE
+from model_router import get_router
+from perf_metrics import get_metrics
+
+# Speculative answers to the follow-up questions an upload analysis suggests.
+#
+# The analysis prompt asks the model for "possible questions someone might ask".
+# Those are parsed out and answered one at a time, at the scheduler's speculative
+# priority (only while the server is otherwise idle), so clicking one shows a
+# ready answer at once. A real request from the session cancels the work in flight;
+# the apps resume it afterwards. A real request from another session preempts it
+# in the scheduler; it is then queued again by itself. Counters in the metrics panel show how many
+# prefetched answers were actually used.
+
+MAX_QUESTIONS = 3
+
+# A heading line that introduces the suggested questions, e.g. "4. Possible questions ..."
+QUESTIONS_HEADING = re.compile(r"(possible|potential|suggested|likely).{0,40}questions?", re.I)
+LIST_MARKER = re.compile(r"^\s*(?:[-*•]|\d+[.)]|[a-z][.)])\s+")
+
+metrics = get_metrics()
+
+
+def normalize_question(question):
+    return re.sub(r"[^a-z0-9]+", " ", question.lower()).strip()
+
+
+def _clean(line):
+    line = LIST_MARKER.sub("", line)
+    line = re.sub(r"\*\*|__|`", "", line).strip().strip('"“”').strip()
+    return line
+
+
+def parse_suggested_questions(analysis, limit=MAX_QUESTIONS):
+    """Pull the suggested follow-up questions out of an analysis reply"""
+    lines = analysis.splitlines()
+    start = next((i + 1 for i, line in enumerate(lines) if QUESTIONS_HEADING.search(line)), None)
+    # Prefer the question list under its heading; fall back to any question in the reply
+    candidates = lines[start:] if start is not None else lines
+    questions = []
+    seen = set()
+    for line in candidates:
+        question = _clean(line)
+        if not question.endswith("?") or len(question) < 10:
+            continue
+        key = normalize_question(question)
+        if key not in seen:
+            seen.add(key)
+            questions.append(question)
+        if len(questions) >= limit:
+            break
+    return questions
+
+
+class SpeculativePrefetcher:
+    """Per-session background answers, shared by every session of the app process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}  # session_id -> {"jobs", "answers", "cancel"}
+        self.generated = 0
+        self.used = 0
+
+    def start(self, session_id, jobs):
+        """Answer (question, send, decision) jobs in the background.
+
+        `send()` must return a streaming response, and `decision` is the router's
+        RouteDecision for it, logged like any other request. Replaces any earlier
+        prefetch of the session (e.g. for a previous upload).
+        """
+        self.cancel_session(session_id)
+        with self._lock:
+            self._sessions[session_id] = {"jobs": list(jobs), "answers": {}, "cancel": None}
+        self.resume(session_id)
+
+    def resume(self, session_id):
+        """Continue with the questions that have no answer yet (after a real request cancelled them)"""
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if not state or (state["cancel"] is not None and not state["cancel"].cancelled):
+                return
+            jobs = [job for job in state["jobs"] if normalize_question(job[0]) not in state["answers"]]
+            if not jobs:
+                return
+            # Registered without superseding anything; a real request's begin() supersedes it
+            cancel = GENERATIONS.begin(session_id, timeout=GENERATION_TIMEOUT, supersede=False)
+            state["cancel"] = cancel
+        threading.Thread(target=self._run, args=(session_id, jobs, cancel), daemon=True).start()
+
+    def _run(self, session_id, jobs, cancel):
+        router = get_router()
+        try:
+            for question, send, decision in jobs:
+                if cancel.cancelled:
+                    return
+                try:
+                    ticket = get_scheduler().submit(session_id, PRIORITY_SPECULATIVE,
+                                                    on_preempt=lambda: cancel.cancel("preempted"))
+                except QueueFullError:
+                    return
+                try:
+                    while not ticket.wait(0.5):
+                        if cancel.poll():
+                            return
+                    response = send()
+                    if response.status_code != 200:
+                        response.close()
+                        router.record(decision, outcome="http_error")
+                        metrics.incr("prefetch_errors")
+                        continue
+                    with metrics.timer("prefetch_generation"):
+                        result = consume_stream(response, cancel=cancel)
+                except GenerationCancelled:
+                    router.record(decision, outcome="cancelled")
+                    metrics.incr("prefetch_cancelled")
+                    return
+                except Exception:
+                    router.record(decision, outcome="error")
+                    metrics.incr("prefetch_errors")
+                    continue
+                finally:
+                    ticket.release()
+                router.record(decision, result=result)
+                metrics.record_ollama(result["final"], source="prefetch")
+                with self._lock:
+                    state = self._sessions.get(session_id)
+                    if state is None or state["cancel"] is not cancel:
+                        return  # replaced by a newer upload meanwhile
+                    state["answers"][normalize_question(question)] = result["text"]
+                    self.generated += 1
+                metrics.incr("prefetch_generated")
+        finally:
+            GENERATIONS.finish(session_id, cancel)
+            with self._lock:
+                state = self._sessions.get(session_id)
+                if state and state["cancel"] is cancel:
+                    state["cancel"] = None
+            if cancel.reason == "preempted":
+                metrics.incr("prefetch_preempted")
+                self.resume(session_id)  # waits in the queue until the server is idle again
+
+    def ready(self, session_id, question):
+        """True if an answer for this question is waiting"""
+        with self._lock:
+            state = self._sessions.get(session_id)
+            return bool(state) and normalize_question(question) in state["answers"]
+
+    def take(self, session_id, question):
+        """Return the prefetched answer for a question (counted as used), or None"""
+        key = normalize_question(question)
+        with self._lock:
+            state = self._sessions.get(session_id)
+            answer = state["answers"].pop(key, None) if state else None
+            if answer is None:
+                return None
+            state["jobs"] = [job for job in state["jobs"] if normalize_question(job[0]) != key]
+            self.used += 1
+        metrics.incr("prefetch_used")
+        return answer
+
+    def pause(self, session_id):
+        """Cancel work in flight but keep the answers and the remaining questions for resume()"""
+        with self._lock:
+            state = self._sessions.get(session_id)
+            cancel = state["cancel"] if state else None
+        if cancel:
+            cancel.cancel("superseded")
+
+    def cancel_session(self, session_id):
+        """Stop and forget a session's speculative work"""
+        with self._lock:
+            state = self._sessions.pop(session_id, None)
+        if not state:
+            return
+        if state["cancel"]:
+            state["cancel"].cancel("superseded")
+        if state["answers"]:
+            metrics.incr("prefetch_unused", len(state["answers"]))
+
+    def hit_rate(self):
+        """Share of generated answers that were used (None before any were generated)"""
+        with self._lock:
+            return self.used / self.generated if self.generated else None
+
+
+# Shared by every session of the app process
+PREFETCHER = SpeculativePrefetcher()
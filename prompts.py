@@ -0,0 +1,60 @@
+# Prompt templates shared by the apps and the load-test driver, so that a load
+# test sends exactly what the apps send.
+
+# pdf.py asks this about every upload
+PDF_ANALYSIS_QUESTION = "Analyze this text briefly. What is it about? Summarize key points in 3-4 sentences."
+
+
+def pdf_prompt(question, context=""):
+    """pdf.py: a question, wrapped with the extracted text when there is some"""
+    if not context:
+        return question
+    return f"""Based on this extracted text:
+
+{context}
+
+User question: {question}
+
+Please provide a helpful response."""
+
+
+def ocr_analysis_prompt(text, code_language="unknown"):
+    """ocr1.py: analysis of a new upload's (possibly condensed) text or code"""
+    if code_language != "unknown":
+        return f"""This appears to be {code_language} code extracted from an image. Please provide:
+1. A brief explanation of what this code does
+2. Key functions or components
+3. Any notable patterns or potential improvements
+4. Possible questions someone might ask about this code
+
+CODE:
+{text}"""
+    return f"""Please analyze this text that was extracted from an image using OCR:
+
+TEXT:
+{text}
+
+Please provide:
+1. A brief summary of what this text appears to be
+2. Key information or points mentioned
+3. Any notable details or observations
+4. Potential questions someone might want to ask about this content"""
+
+
+def ocr_context_prompt(question, ocr_text):
+    """ocr1.py: a chat question about the current OCR text"""
+    return f"""You are having a conversation about this extracted text from an image:
+
+EXTRACTED TEXT:
+{ocr_text}
+
+Please answer the following question in context of this extracted text:
+{question}
+
+If the question is not related to the extracted text, you can answer generally but try to relate it back to the extracted text when possible.
+Respond concisely."""
+
+
+def chat_messages(history):
+    """chatbot apps: the /api/chat messages for a history of {"role", "content", ...} entries"""
+    return [{"role": m["role"], "content": m["content"]} for m in history]
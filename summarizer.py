@@ -0,0 +1,188 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ollama_client import (generate_request, consume_stream, DEFAULT_MODEL, GENERATIONS, GENERATION_TIMEOUT,
+                           OllamaHTTPError)
+from ollama_scheduler import get_scheduler, MAX_CONCURRENT, MAX_QUEUED_PER_SESSION, PRIORITY_BACKGROUND
+from perf_metrics import get_metrics
+
+# Map-reduce condensing of long extracted text for the upload analysis.
+#
+# Text that fits in one prompt is returned unchanged. Longer text is split into
+# page- or paragraph-bounded chunks, each chunk is summarised in parallel (as
+# background requests through the shared scheduler) and the partial summaries
+# replace the text in the app's normal analysis prompt, which is the reduce pass.
+# Chunk summaries are cached by content hash, so re-uploading or editing a
+# document only summarises the chunks that changed.
+
+# ------------------ Config ------------------
+# Largest chunk (and largest text sent as-is), in estimated tokens
+CHUNK_TOKENS = int(os.environ.get("SUMMARY_CHUNK_TOKENS", "1500"))
+# Chunk requests in flight per document; capped so one upload can't fill its session's queue
+MAX_PARALLEL = max(1, min(int(os.environ.get("SUMMARY_MAX_PARALLEL", str(MAX_CONCURRENT))), MAX_QUEUED_PER_SESSION))
+# Summaries of summaries, at most this many levels deep
+MAX_LEVELS = 3
+CACHE_SIZE = 1024
+
+MAP_PROMPTS = {
+    "text": """Summarise this section of a longer document in 2-4 sentences.
+Keep names, numbers, dates and key facts. Reply with the summary only.
+
+SECTION:
+{chunk}""",
+    "code": """Describe what this part of a larger program does in 2-4 sentences.
+Name the functions, classes and important variables it defines or uses. Reply with the description only.
+
+CODE:
+{chunk}""",
+}
+
+PAGE_MARKER = re.compile(r"(?m)^(?=--- Page )")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+metrics = get_metrics()
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token)"""
+    return len(text) // 4
+
+
+def _hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _split_units(text, max_chars):
+    """Pages (pdf.py marks them) or paragraphs, with anything too long cut at line breaks"""
+    pieces = PAGE_MARKER.split(text) if PAGE_MARKER.search(text) else PARAGRAPH_BREAK.split(text)
+    units = []
+    for piece in pieces:
+        piece = piece.strip()
+        while len(piece) > max_chars:
+            cut = piece.rfind("\n", 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            units.append(piece[:cut].strip())
+            piece = piece[cut:].strip()
+        if piece:
+            units.append(piece)
+    return units
+
+
+def split_chunks(text, max_tokens=CHUNK_TOKENS):
+    """Split text into chunks of at most max_tokens, on page or paragraph boundaries"""
+    max_chars = max_tokens * 4
+    chunks = []
+    current = []
+    size = 0
+    for unit in _split_units(text, max_chars):
+        if current and size + len(unit) > max_chars:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(unit)
+        size += len(unit) + 2
+        # Once a chunk is half full, a unit whose hash ends in 00 closes it. Boundaries depend on
+        # content rather than on offsets, so an edit only changes the chunk around it.
+        if size >= max_chars // 2 and int(_hash(unit)[:8], 16) % 4 == 0:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def _cache_get(key):
+    with _cache_lock:
+        summary = _cache.get(key)
+        if summary is not None:
+            _cache.move_to_end(key)
+        return summary
+
+
+def _cache_put(key, summary):
+    with _cache_lock:
+        _cache[key] = summary
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _summarize_chunk(chunk, kind, model, session_id, cancel):
+    """Worker: wait for a background slot, then summarise one chunk"""
+    ticket = get_scheduler().submit(session_id, PRIORITY_BACKGROUND)
+    try:
+        while not ticket.wait(0.25):
+            cancel.check()
+        cancel.check()
+        with metrics.timer("summary_map", kind=kind):
+            response = generate_request(model, MAP_PROMPTS[kind].format(chunk=chunk), stream=True)
+            if response.status_code != 200:
+                response.close()
+                raise OllamaHTTPError(response.status_code, response.text)
+            result = consume_stream(response, cancel=cancel)
+        metrics.record_ollama(result["final"], source="summary_map")
+        return result["text"].strip()
+    finally:
+        ticket.release()
+
+
+def _map(chunks, kind, model, session_id, cancel, on_progress):
+    """Summarise chunks in parallel, reusing cached summaries; runs on the caller's thread"""
+    keys = [_hash(f"{model}\0{kind}\0{chunk}") for chunk in chunks]
+    summaries = [_cache_get(key) for key in keys]
+    todo = [i for i, summary in enumerate(summaries) if summary is None]
+    metrics.incr("summary_chunks", len(chunks) - len(todo), cached="true")
+    metrics.incr("summary_chunks", len(todo), cached="false")
+    if on_progress:
+        on_progress(len(chunks) - len(todo), len(chunks))
+    if not todo:
+        return summaries
+
+    executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL)
+    futures = {executor.submit(_summarize_chunk, chunks[i], kind, model, session_id, cancel): i for i in todo}
+    pending = set(futures)
+    try:
+        # Waiting in short steps keeps the caller's thread free to update the UI,
+        # which is where Streamlit can stop the run
+        while pending:
+            done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            cancel.check()
+            for future in done:
+                i = futures[future]
+                summaries[i] = future.result()
+                _cache_put(keys[i], summaries[i])
+            if on_progress:
+                on_progress(sum(1 for s in summaries if s is not None), len(chunks))
+    finally:
+        if pending:
+            cancel.cancel("stopped")
+        executor.shutdown(wait=False, cancel_futures=True)
+    return summaries
+
+
+def condense_text(text, session_id, kind="text", model=DEFAULT_MODEL, on_progress=None):
+    """Return text short enough for one analysis prompt.
+
+    Short text comes back unchanged. Longer text is replaced by its chunk
+    summaries ("[Part i/n] ..."), summarising again until it fits.
+    on_progress(done, total) is called on the caller's thread while chunks finish.
+    """
+    if estimate_tokens(text) <= CHUNK_TOKENS:
+        return text
+    cancel = GENERATIONS.begin(session_id, timeout=GENERATION_TIMEOUT)
+    try:
+        with metrics.timer("summary_condense", kind=kind):
+            for level in range(MAX_LEVELS):
+                chunks = split_chunks(text)
+                summaries = _map(chunks, kind if level == 0 else "text", model, session_id, cancel, on_progress)
+                text = "\n\n".join(f"[Part {i}/{len(chunks)}] {s}" for i, s in enumerate(summaries, 1))
+                if estimate_tokens(text) <= CHUNK_TOKENS:
+                    break
+    finally:
+        GENERATIONS.finish(session_id, cancel)
+    return text
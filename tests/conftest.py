@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The app modules live at the repository root, next to the Streamlit scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Tests must not append to the app's metrics trace or router log
+os.environ.setdefault("METRICS_TRACE_PATH", "")
+os.environ.setdefault("ROUTER_LOG_PATH", "")
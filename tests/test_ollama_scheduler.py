@@ -0,0 +1,176 @@
+import pytest
+
+from ollama_scheduler import (OllamaScheduler, QueueFullError, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND,
+                              PRIORITY_SPECULATIVE, acquire_with_status)
+
+
+def make_scheduler(max_concurrent=1, max_queue=32, max_queued_per_session=4):
+    return OllamaScheduler(max_concurrent=max_concurrent, max_queue=max_queue,
+                           max_queued_per_session=max_queued_per_session)
+
+
+def grant_order(scheduler, tickets):
+    """Release running tickets one by one and return the order the rest were granted in"""
+    order = []
+    pending = list(tickets)
+    while pending:
+        running = [t for t in pending if t.granted]
+        assert len(running) == 1
+        order.append(running[0])
+        pending.remove(running[0])
+        running[0].release()
+    return order
+
+
+def test_grants_up_to_max_concurrent():
+    scheduler = make_scheduler(max_concurrent=2)
+    tickets = [scheduler.submit(f"s{i}") for i in range(3)]
+    assert [t.granted for t in tickets] == [True, True, False]
+    tickets[0].release()
+    assert tickets[2].granted
+    assert scheduler.stats()["active"] == 2
+
+
+def test_interactive_served_before_background():
+    scheduler = make_scheduler()
+    blocker = scheduler.submit("a")
+    background = scheduler.submit("b", PRIORITY_BACKGROUND)
+    interactive = scheduler.submit("c", PRIORITY_INTERACTIVE)
+    blocker.release()
+    assert interactive.granted
+    assert not background.granted
+
+
+def test_sessions_take_turns_within_a_priority():
+    scheduler = make_scheduler()
+    blocker = scheduler.submit("x")
+    a1, a2, a3 = (scheduler.submit("a") for _ in range(3))
+    b1 = scheduler.submit("b")
+    c1 = scheduler.submit("c")
+    blocker.release()
+    assert grant_order(scheduler, [a1, a2, a3, b1, c1]) == [a1, b1, c1, a2, a3]
+
+
+def test_position_follows_dispatch_order():
+    scheduler = make_scheduler()
+    running = scheduler.submit("x")
+    a1, a2 = scheduler.submit("a"), scheduler.submit("a")
+    b1 = scheduler.submit("b")
+    background = scheduler.submit("c", PRIORITY_BACKGROUND)
+    assert running.position() == 0
+    assert [a1.position(), b1.position(), a2.position(), background.position()] == [1, 2, 3, 4]
+    b1.release()
+    assert [a1.position(), a2.position(), background.position()] == [1, 2, 3]
+    assert b1.position() == 0
+
+
+def test_estimated_wait_scales_with_position():
+    scheduler = make_scheduler(max_concurrent=2)
+    scheduler.submit("x"), scheduler.submit("y")
+    first, second, third = (scheduler.submit(s) for s in ("a", "b", "c"))
+    assert first.estimated_wait() == second.estimated_wait() > 0
+    assert third.estimated_wait() == 2 * first.estimated_wait()
+
+
+def test_per_session_queue_limit():
+    scheduler = make_scheduler(max_queued_per_session=2)
+    scheduler.submit("x")
+    scheduler.submit("a"), scheduler.submit("a")
+    with pytest.raises(QueueFullError):
+        scheduler.submit("a")
+    # Other sessions, and the same session at another priority, still get in
+    scheduler.submit("b")
+    scheduler.submit("a", PRIORITY_BACKGROUND)
+
+
+def test_global_queue_limit():
+    scheduler = make_scheduler(max_queue=2)
+    scheduler.submit("x")
+    scheduler.submit("a"), scheduler.submit("b")
+    with pytest.raises(QueueFullError):
+        scheduler.submit("c")
+
+
+def test_releasing_a_waiting_ticket_frees_its_place():
+    scheduler = make_scheduler(max_queued_per_session=1)
+    running = scheduler.submit("x")
+    waiting = scheduler.submit("a")
+    waiting.release()
+    assert scheduler.stats()["waiting"] == 0
+    replacement = scheduler.submit("a")
+    running.release()
+    assert replacement.granted
+    assert not waiting.granted
+
+
+def test_release_is_idempotent():
+    scheduler = make_scheduler()
+    first = scheduler.submit("a")
+    second = scheduler.submit("b")
+    first.release()
+    first.release()
+    assert second.granted
+    assert scheduler.stats()["active"] == 1
+
+
+def test_speculative_never_takes_the_last_free_slot():
+    scheduler = make_scheduler(max_concurrent=2)
+    speculative = [scheduler.submit(s, PRIORITY_SPECULATIVE) for s in ("a", "b")]
+    assert [t.granted for t in speculative] == [True, False]
+
+
+def test_real_request_preempts_speculative_work():
+    scheduler = make_scheduler(max_concurrent=1)
+    preempted = []
+    speculative = scheduler.submit("a", PRIORITY_SPECULATIVE, on_preempt=lambda: preempted.append("a"))
+    assert speculative.granted  # the only slot is free, so speculation may use it
+    real = scheduler.submit("b", PRIORITY_BACKGROUND)
+    assert real.granted
+    assert speculative.preempted and preempted == ["a"]
+    speculative.release()  # the preempted owner's own release must not free another slot
+    assert scheduler.stats()["active"] == 1
+
+
+def test_speculative_waits_while_real_work_runs():
+    scheduler = make_scheduler(max_concurrent=1)
+    real = scheduler.submit("a")
+    speculative = scheduler.submit("b", PRIORITY_SPECULATIVE)
+    assert not speculative.granted
+    real.release()
+    assert speculative.granted
+
+
+class InterruptingPlaceholder:
+    """Stands in for st.empty(); raises like Streamlit does when Stop or a rerun arrives"""
+
+    class Interrupted(BaseException):
+        pass
+
+    def __init__(self, interrupt_on):
+        self.interrupt_on = interrupt_on
+
+    def info(self, text):
+        if self.interrupt_on == "info":
+            raise self.Interrupted()
+
+    def empty(self):
+        if self.interrupt_on == "empty":
+            raise self.Interrupted()
+
+
+def test_acquire_releases_a_ticket_interrupted_right_after_the_grant():
+    scheduler = make_scheduler()
+    with pytest.raises(InterruptingPlaceholder.Interrupted):
+        acquire_with_status(scheduler.submit("a"), InterruptingPlaceholder("empty"))
+    assert scheduler.stats()["active"] == 0
+    assert scheduler.submit("b").granted
+
+
+def test_acquire_releases_a_ticket_interrupted_while_waiting():
+    scheduler = make_scheduler()
+    running = scheduler.submit("x")
+    with pytest.raises(InterruptingPlaceholder.Interrupted):
+        acquire_with_status(scheduler.submit("a"), InterruptingPlaceholder("info"), poll_interval=0.01)
+    assert scheduler.stats()["waiting"] == 0
+    running.release()
+    assert scheduler.stats()["active"] == 0
@@ -0,0 +1,119 @@
+import json
+import time
+
+import pytest
+
+import ollama_scheduler
+from model_router import get_router
+from ollama_scheduler import OllamaScheduler
+from prefetch import SpeculativePrefetcher, parse_suggested_questions
+
+ANALYSIS = """1. Summary: a small Python script.
+2. Key points: it reads a file.
+
+4. Possible questions someone might ask:
+- What does the `main` function do?
+- **How could the error handling be improved?**
+- Why is the file opened twice?
+- Is this thread-safe?
+"""
+
+
+class FakeResponse:
+    """A finished /api/generate stream with a fixed answer"""
+
+    status_code = 200
+
+    def __init__(self, answer):
+        self.answer = answer
+
+    def iter_lines(self):
+        yield json.dumps({"response": self.answer, "done": False}).encode()
+        yield json.dumps({"response": "", "done": True, "eval_count": 1}).encode()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def scheduler(monkeypatch):
+    scheduler = OllamaScheduler(max_concurrent=2)
+    monkeypatch.setattr(ollama_scheduler, "_scheduler", scheduler)
+    return scheduler
+
+
+def job(question, sent=None):
+    """A prefetch job shaped the way ocr1.start_prefetch builds them"""
+    def send():
+        if sent is not None:
+            sent.append(question)
+        return FakeResponse(f"answer to {question}")
+    return question, send, get_router().route(question, app="test_prefetch")
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def finished(prefetcher, session_id):
+    """True once the session's background run has ended (resume() starts a new one only then)"""
+    with prefetcher._lock:
+        return prefetcher._sessions[session_id]["cancel"] is None
+
+
+def test_parse_suggested_questions_reads_the_list_under_its_heading():
+    assert parse_suggested_questions(ANALYSIS) == [
+        "What does the main function do?",
+        "How could the error handling be improved?",
+        "Why is the file opened twice?",
+    ]
+
+
+def test_parse_suggested_questions_without_heading_or_questions():
+    assert parse_suggested_questions("Is it Python? It reads a file.\nWhat does it print?") == ["What does it print?"]
+    assert parse_suggested_questions("No questions here.") == []
+
+
+def test_take_returns_a_ready_answer_once():
+    prefetcher = SpeculativePrefetcher()
+    prefetcher.start("s", [job("What does main do?"), job("Why twice?")])
+    wait_until(lambda: prefetcher.ready("s", "why twice"))
+    assert prefetcher.take("s", "What does main do?") == "answer to What does main do?"
+    assert prefetcher.take("s", "What does main do?") is None
+    assert prefetcher.used == 1 and prefetcher.generated == 2
+    assert prefetcher.hit_rate() == 0.5
+
+
+def test_take_without_an_answer():
+    prefetcher = SpeculativePrefetcher()
+    assert prefetcher.take("unknown", "What?") is None
+    assert prefetcher.used == 0
+
+
+def test_resume_only_answers_what_is_missing():
+    prefetcher = SpeculativePrefetcher()
+    sent = []
+    prefetcher.start("s", [job("First question?", sent)])
+    wait_until(lambda: finished(prefetcher, "s"))
+    with prefetcher._lock:
+        prefetcher._sessions["s"]["jobs"].append(job("Second question?", sent))
+    prefetcher.resume("s")
+    wait_until(lambda: finished(prefetcher, "s"))
+    assert sent == ["First question?", "Second question?"]
+    # A taken answer is not fetched again either
+    prefetcher.take("s", "First question?")
+    prefetcher.resume("s")
+    time.sleep(0.05)
+    assert sent == ["First question?", "Second question?"]
+
+
+def test_cancel_session_forgets_the_answers():
+    prefetcher = SpeculativePrefetcher()
+    prefetcher.start("s", [job("What does main do?")])
+    wait_until(lambda: prefetcher.ready("s", "What does main do?"))
+    prefetcher.cancel_session("s")
+    assert not prefetcher.ready("s", "What does main do?")
+    assert prefetcher.take("s", "What does main do?") is None